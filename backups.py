@@ -0,0 +1,196 @@
+import csv
+import gzip
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+MANIFEST_NAME = 'manifest.json'
+ROTATE_PATTERNS = ('network_connections_final_*.csv', 'network_connections_final_*.txt')
+CHUNK_SIZE = 1024 * 1024
+
+def compress_file(source, destination):
+    """
+    Stream-compress a file with gzip, replacing the source on success.
+    Runs in a worker process.
+    Returns:
+        tuple: (original size, compressed size) in bytes
+    """
+    source = Path(source)
+    destination = Path(destination)
+    partial = destination.with_name(destination.name + '.partial')
+    original_size = source.stat().st_size
+    with source.open('rb') as infile, gzip.open(partial, 'wb') as outfile:
+        shutil.copyfileobj(infile, outfile, CHUNK_SIZE)
+    os.replace(partial, destination)
+    source.unlink()
+    return original_size, destination.stat().st_size
+
+class BackupRotationPolicy:
+    """
+    Limits applied to compressed backup archives. Any limit set to None is
+    not enforced; the oldest archives are removed first.
+    """
+    def __init__(self, max_total_bytes=100 * 1024 * 1024, max_age_days=30, max_count=200):
+        self.max_total_bytes = max_total_bytes
+        self.max_age_days = max_age_days
+        self.max_count = max_count
+
+    def expired(self, archives, now):
+        """Return the archives (oldest first) that fall outside the limits"""
+        archives = sorted(archives, key=lambda entry: entry['created'])
+        total_bytes = sum(entry['compressed_size'] for entry in archives)
+        remaining = len(archives)
+        expired = []
+        for entry in archives:
+            age_days = (now - datetime.fromisoformat(entry['created'])).total_seconds() / 86400
+            if ((self.max_count is not None and remaining > self.max_count) or
+                    (self.max_total_bytes is not None and total_bytes > self.max_total_bytes) or
+                    (self.max_age_days is not None and age_days > self.max_age_days)):
+                expired.append(entry)
+                remaining -= 1
+                total_bytes -= entry['compressed_size']
+        return expired
+
+class BackupManager:
+    """
+    Compresses finished backups in a process pool, keeps a manifest of the
+    archives and prunes them according to a BackupRotationPolicy.
+    """
+    def __init__(self, backup_dir, policy=None, max_workers=2):
+        self.backup_dir = Path(backup_dir)
+        self.policy = policy or BackupRotationPolicy()
+        self.max_workers = max_workers
+        self.executor = None
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def rotate(self):
+        """
+        Queue every finished, uncompressed backup for compression.
+        Returns immediately; the work happens in worker processes.
+        Returns:
+            int: Number of files queued
+        """
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+        queued = 0
+        for pattern in ROTATE_PATTERNS:
+            for source in sorted(self.backup_dir.glob(pattern)):
+                with self.lock:
+                    if source in self.pending:
+                        continue
+                    self.pending.add(source)
+                destination = source.with_name(source.name + '.gz')
+                future = self.executor.submit(compress_file, str(source), str(destination))
+                future.add_done_callback(
+                    lambda future, source=source, destination=destination:
+                        self.compression_done(future, source, destination)
+                )
+                queued += 1
+        return queued
+
+    def compression_done(self, future, source, destination):
+        """Record a finished archive in the manifest and apply the rotation policy"""
+        with self.lock:
+            self.pending.discard(source)
+            try:
+                original_size, compressed_size = future.result()
+            except Exception as e:
+                print(f"Error compressing backup {source.name}: {e}")
+                return
+
+            manifest = load_manifest(self.backup_dir)
+            manifest['archives'] = [entry for entry in manifest['archives']
+                                    if entry['name'] != destination.name]
+            manifest['archives'].append({
+                'name': destination.name,
+                'source': source.name,
+                'created': datetime.fromtimestamp(destination.stat().st_mtime).isoformat(),
+                'size': original_size,
+                'compressed_size': compressed_size,
+            })
+            self.prune(manifest)
+            save_manifest(self.backup_dir, manifest)
+
+    def prune(self, manifest):
+        """Delete archives that fall outside the policy and drop them from the manifest"""
+        expired = self.policy.expired(manifest['archives'], datetime.now())
+        for entry in expired:
+            try:
+                (self.backup_dir / entry['name']).unlink()
+            except FileNotFoundError:
+                pass
+        names = {entry['name'] for entry in expired}
+        manifest['archives'] = [entry for entry in manifest['archives'] if entry['name'] not in names]
+
+    def shutdown(self, wait=True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+def load_manifest(backup_dir):
+    """Load the archive manifest, returning an empty one if it is missing or unreadable"""
+    try:
+        with (Path(backup_dir) / MANIFEST_NAME).open('r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+        if isinstance(manifest.get('archives'), list):
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'archives': []}
+
+def save_manifest(backup_dir, manifest):
+    """Atomically replace the archive manifest"""
+    path = Path(backup_dir) / MANIFEST_NAME
+    partial = path.with_name(path.name + '.partial')
+    with partial.open('w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(partial, path)
+
+def list_backups(backup_dir):
+    """
+    List every readable backup, compressed or not.
+    Returns:
+        list: (name, size in bytes, compressed) tuples, oldest first
+    """
+    backup_dir = Path(backup_dir)
+    backups = []
+    for entry in sorted(load_manifest(backup_dir)['archives'], key=lambda entry: entry['created']):
+        if (backup_dir / entry['name']).exists():
+            backups.append((entry['source'], entry['size'], True))
+    for pattern in ('network_connections_*.csv', 'network_connections_*.txt'):
+        for path in sorted(backup_dir.glob(pattern)):
+            backups.append((path.name, path.stat().st_size, False))
+    return backups
+
+def resolve_backup(backup_dir, name):
+    """
+    Find the file holding a backup, given either its original or archive name.
+    Returns:
+        Path: The plain or gzip-compressed file
+    """
+    backup_dir = Path(backup_dir)
+    for candidate in (backup_dir / name, backup_dir / (name + '.gz')):
+        if candidate.exists():
+            return candidate
+    for entry in load_manifest(backup_dir)['archives']:
+        if name in (entry['source'], entry['name']):
+            return backup_dir / entry['name']
+    raise FileNotFoundError(f"No backup named {name} in {backup_dir}")
+
+def open_backup(path):
+    """Open a backup for reading as text, decompressing it transparently"""
+    path = Path(path)
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return path.open('r', encoding='utf-8', newline='')
+
+def read_backup_csv(path):
+    """Yield the rows of a CSV backup (header included), compressed or not"""
+    with open_backup(path) as backup_file:
+        yield from csv.reader(backup_file)
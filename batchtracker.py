@@ -0,0 +1,338 @@
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from networkmonitor import ConnectionTracker
+from statehistory import STATUSES, StateHistory, status_code
+
+# Timestamps are stored as microseconds since this naive epoch so that the
+# datetimes handed back are exactly the ones the pure-Python tracker stores
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_micros(moment):
+    return (moment - EPOCH) // MICROSECOND
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+class Interner(dict):
+    """Maps strings to dense integer ids; the empty string is always id 0"""
+    def __init__(self):
+        super().__init__({'': 0})
+        self.names = ['']
+
+    def __missing__(self, name):
+        ident = len(self.names)
+        self[name] = ident
+        self.names.append(name)
+        return ident
+
+class StatusCodes(dict):
+    """Maps status names to statehistory's one-byte codes"""
+    def __missing__(self, status):
+        code = status_code(status)
+        self[status] = code
+        return code
+
+class SortedIndex:
+    """A sorted uint64 key column with a parallel int64 value column"""
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.values = np.empty(0, dtype=np.int64)
+
+    def lookup(self, keys):
+        """
+        Find sorted, unique keys.
+        Returns:
+            tuple: (positions in the index, boolean mask of keys that were found)
+        """
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        return positions, found
+
+    def insert(self, positions, keys, values):
+        """Insert sorted keys missing from the index at the positions lookup returned"""
+        self.keys = np.insert(self.keys, positions, keys)
+        self.values = np.insert(self.values, positions, values)
+
+    def intern(self, keys):
+        """Return a dense id for every key, assigning new ids to unseen keys"""
+        unique, inverse = np.unique(keys, return_inverse=True)
+        positions, found = self.lookup(unique)
+        ids = np.empty(len(unique), dtype=np.int64)
+        ids[found] = self.values[positions[found]]
+        missing = ~found
+        if missing.any():
+            ids[missing] = np.arange(len(self.keys), len(self.keys) + missing.sum())
+            self.insert(positions[missing], unique[missing], ids[missing])
+        return ids[inverse.reshape(-1)]
+
+class PackedTable:
+    """Column store for one protocol's connections, one row per connection"""
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.index = SortedIndex()
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.first_seen = np.zeros(capacity, dtype=np.int64)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        self.status = np.zeros(capacity, dtype=np.uint8)
+        self.info = []
+        self.history = []
+        self.metrics = []
+
+    def reserve(self, extra):
+        needed = self.size + extra
+        capacity = len(self.count)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ('count', 'first_seen', 'last_seen', 'status'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def record(self, row):
+        """Materialise one row in the pure-Python tracker's record format"""
+        return {
+            'count': int(self.count[row]),
+            'first_seen': from_micros(int(self.first_seen[row])),
+            'last_seen': from_micros(int(self.last_seen[row])),
+            'info': self.info[row],
+            'status': STATUSES[self.status[row]],
+            'history': self.history[row],
+            'metrics': self.metrics[row],
+        }
+
+class PackedConnections(Mapping):
+    """
+    Read-only view of a PackedTable shaped like ConnectionTracker's
+    tcp_connections/udp_connections, keyed by row number. Records are built
+    on access, so changes made to them are not stored.
+    """
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, row):
+        if not 0 <= row < self.table.size:
+            raise KeyError(row)
+        return self.table.record(row)
+
+    def __iter__(self):
+        return iter(range(self.table.size))
+
+    def __len__(self):
+        return self.table.size
+
+    def values(self):
+        table = self.table
+        size = table.size
+        columns = zip(table.count[:size].tolist(), table.first_seen[:size].tolist(),
+                      table.last_seen[:size].tolist(), table.status[:size].tolist(),
+                      table.info, table.history, table.metrics)
+        for count, first_seen, last_seen, status, info, history, metrics in columns:
+            yield {
+                'count': count,
+                'first_seen': from_micros(first_seen),
+                'last_seen': from_micros(last_seen),
+                'info': info,
+                'status': STATUSES[status],
+                'history': history,
+                'metrics': metrics,
+            }
+
+class BatchConnectionTracker(ConnectionTracker):
+    """
+    ConnectionTracker that merges whole snapshots with NumPy instead of
+    looping over every socket in Python.
+
+    Each snapshot is packed into integer arrays: IPs are interned to ids,
+    endpoints become ip_id << 16 | port and are interned again, and a
+    connection key is the ordered pair of endpoint ids in one uint64. Keys are
+    deduplicated with np.unique and merged against a sorted key table with
+    np.searchsorted; counts, last-seen times and statuses are then updated
+    column-wise. Python work remains only for new connections, status changes
+    and sockets that appear twice in one snapshot.
+
+    Results (exports, newly discovered connections, rollups and sketches) are
+    identical to the pure-Python tracker. tcp_connections and udp_connections
+    are read-only views.
+    """
+    def __init__(self):
+        super().__init__()
+        self.ip_ids = Interner()
+        self.status_codes = StatusCodes()
+        self.endpoints = SortedIndex()
+        self.tables = {'TCP': PackedTable(), 'UDP': PackedTable()}
+        self.tcp_connections = PackedConnections(self.tables['TCP'])
+        self.udp_connections = PackedConnections(self.tables['UDP'])
+        self.live_keys = {'TCP': np.empty(0, dtype=np.int64), 'UDP': np.empty(0, dtype=np.int64)}
+        # Occurrences of each live row in the previous snapshot, replayed by sync()
+        self.live_counts = {'TCP': np.empty(0, dtype=np.int64), 'UDP': np.empty(0, dtype=np.int64)}
+
+    def pack(self, connections):
+        """
+        Pack a snapshot into connection keys.
+        Returns:
+            tuple: (uint64 keys, status codes, TCP mask, remote IP ids)
+        """
+        n = len(connections)
+        columns = list(zip(*connections)) if n else [()] * 6
+        local_ips = np.fromiter(map(self.ip_ids.__getitem__, columns[0]), dtype=np.int64, count=n)
+        local_ports = np.fromiter(columns[1], dtype=np.int64, count=n)
+        remote_ips = np.fromiter(map(self.ip_ids.__getitem__, columns[2]), dtype=np.int64, count=n)
+        remote_ports = np.fromiter(columns[3], dtype=np.int64, count=n)
+        codes = np.fromiter(map(self.status_codes.__getitem__, columns[4]), dtype=np.uint8, count=n)
+        is_tcp = np.array(columns[5], dtype=object) == 'TCP'
+
+        local_endpoints = (local_ips << 16) | local_ports
+        remote_endpoints = (remote_ips << 16) | remote_ports
+        # UDP sockets without a remote address are keyed on the local endpoint only
+        remote_endpoints[(remote_ips == 0) & ~is_tcp] = 0
+
+        ids = self.endpoints.intern(np.concatenate((local_endpoints, remote_endpoints)).astype(np.uint64))
+        local_ids = ids[:n].astype(np.uint64)
+        remote_ids = ids[n:].astype(np.uint64)
+        keys = (np.minimum(local_ids, remote_ids) << np.uint64(32)) | np.maximum(local_ids, remote_ids)
+        return keys, codes, is_tcp, remote_ips
+
+    def update(self, new_connections, fingerprint=None):
+        """
+        Update the connection history with new connections.
+        Returns newly discovered connections for both TCP and UDP.
+        """
+        current_time = datetime.now()
+        if fingerprint is not None and fingerprint == self.last_fingerprint:
+            self.repeat_last_snapshot(current_time)
+            return []
+
+        self.sync()
+        self.ticks_processed += 1
+        self.status_changes = []
+        keys, codes, is_tcp, remote_ips = self.pack(new_connections)
+        tracked_before = {'TCP': self.total_tcp_tracked, 'UDP': self.total_udp_tracked}
+
+        new_positions = []
+        live_keys = {}
+        live_counts = {}
+        remotes = {}
+        for protocol, mask in (('TCP', is_tcp), ('UDP', ~is_tcp)):
+            positions = np.flatnonzero(mask)
+            rows, counts, discovered = self.merge(
+                self.tables[protocol], keys[positions], codes[positions], positions,
+                new_connections, current_time
+            )
+            live_keys[protocol] = rows
+            live_counts[protocol] = counts
+            new_positions.extend(discovered)
+            if protocol == 'TCP':
+                self.total_tcp_tracked += len(discovered)
+            else:
+                self.total_udp_tracked += len(discovered)
+            remotes[protocol] = {self.ip_ids.names[ident]
+                                 for ident in np.unique(remote_ips[positions]).tolist() if ident}
+
+        newly_discovered = [new_connections[position] for position in sorted(new_positions)]
+
+        self.record_rollups(current_time, live_keys, remotes, tracked_before)
+        self.live_counts = live_counts
+        self.live_remotes = remotes
+        self.all_live_remotes = remotes['TCP'] | remotes['UDP']
+        self.analytics.update(current_time.timestamp(), newly_discovered, self.all_live_remotes)
+        self.last_fingerprint = fingerprint
+        return newly_discovered
+
+    def merge(self, table, keys, codes, positions, connections, current_time):
+        """
+        Merge one protocol's part of a snapshot into its table.
+        Returns:
+            tuple: (live rows, occurrences per live row, snapshot positions of new
+                connections)
+        """
+        unique, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        index_positions, found = table.index.lookup(unique)
+        rows = np.empty(len(unique), dtype=np.int64)
+        rows[found] = table.index.values[index_positions[found]]
+
+        # New connections get rows in the order they appear in the snapshot
+        missing = np.flatnonzero(~found)
+        new_unique = missing[np.argsort(first[missing], kind='stable')]
+        new_rows = np.arange(table.size, table.size + len(new_unique))
+        rows[new_unique] = new_rows
+        if len(new_unique):
+            table.index.insert(index_positions[missing], unique[missing], rows[missing])
+            table.reserve(len(new_unique))
+            table.size += len(new_unique)
+            now = to_micros(current_time)
+            table.first_seen[new_rows] = now
+            table.status[new_rows] = codes[first[new_unique]]
+            table.info.extend(connections[position] for position in positions[first[new_unique]].tolist())
+            table.history.extend([None] * len(new_unique))
+            table.metrics.extend([None] * len(new_unique))
+
+        # Status changes, taken from the first occurrence of each socket. Both
+        # ends of a local connection share one row and may differ in status
+        # (FIN_WAIT2/CLOSE_WAIT); only the recorded side changes it
+        changed = np.flatnonzero(found)
+        changed = changed[table.status[rows[changed]] != codes[first[changed]]]
+        for unique_index in changed.tolist():
+            row = rows[unique_index]
+            conn_info = connections[positions[first[unique_index]]]
+            if conn_info[:2] != table.info[row][:2]:
+                continue
+            self.record_packed_transition(table, row, codes[first[unique_index]], current_time)
+            self.status_changes.append(conn_info)
+
+        table.count[rows] += counts
+        table.last_seen[rows] = to_micros(current_time)
+        return rows, counts, positions[first[new_unique]].tolist()
+
+    def record_packed_transition(self, table, row, code, current_time):
+        """Record a status change; the history is only allocated on the first change"""
+        if table.history[row] is None:
+            first_seen = from_micros(int(table.first_seen[row]))
+            table.history[row] = StateHistory(STATUSES[table.status[row]], first_seen.timestamp())
+        table.history[row].record(STATUSES[code], current_time.timestamp())
+        table.status[row] = code
+
+    def record_tcp_metrics(self, samples):
+        """Store tcp_info samples on the matching TCP rows"""
+        if not samples:
+            return
+        keys, _, _, _ = self.pack([conn_info for conn_info, _ in samples])
+        table = self.tables['TCP']
+        index_positions, found = table.index.lookup(keys)
+        for sample_index in np.flatnonzero(found).tolist():
+            row = table.index.values[index_positions[sample_index]]
+            conn_info, metrics = samples[sample_index]
+            # Both ends of a local connection share one row; follow the recorded side
+            if conn_info[:2] != table.info[row][:2]:
+                continue
+            metrics.add_deltas(table.metrics[row])
+            table.metrics[row] = metrics
+
+    def record_rollups(self, current_time, live_keys, remotes, tracked_before):
+        """Feed the time-windowed rollups with the result of one update"""
+        timestamp = current_time.timestamp()
+        tracked_after = {'TCP': self.total_tcp_tracked, 'UDP': self.total_udp_tracked}
+        for protocol, rows in live_keys.items():
+            closed = len(np.setdiff1d(self.live_keys[protocol], rows, assume_unique=True))
+            self.rollups.record(timestamp, protocol,
+                                tracked_after[protocol] - tracked_before[protocol],
+                                closed, remotes[protocol], len(rows))
+        self.live_keys = live_keys
+
+    def sync(self):
+        """Apply skipped repeats to the live rows"""
+        if not self.pending_repeats:
+            return
+        pending_time = to_micros(self.pending_time)
+        for protocol, table in self.tables.items():
+            rows = self.live_keys[protocol]
+            table.count[rows] += self.live_counts[protocol] * self.pending_repeats
+            table.last_seen[rows] = pending_time
+        self.pending_repeats = 0
@@ -0,0 +1,77 @@
+"""
+Compare ConnectionTracker.update with the NumPy BatchConnectionTracker (and
+optionally the multi-process ShardedConnectionTracker) on large synthetic
+snapshots.
+
+Usage: python3 benchmark_tracker.py [--sockets 100000 200000] [--rounds 5] [--shards N]
+"""
+import argparse
+import random
+import time
+
+from networkmonitor import ConnectionTracker
+
+def make_snapshot(sockets, seed=0):
+    """Build a synthetic snapshot of mostly TCP sockets plus some UDP listeners"""
+    rng = random.Random(seed)
+    remotes = [f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+               for _ in range(max(1, sockets // 20))]
+    statuses = ['ESTABLISHED'] * 8 + ['TIME_WAIT', 'CLOSE_WAIT']
+    snapshot = []
+    for index in range(sockets):
+        if index % 50 == 0:
+            snapshot.append(('0.0.0.0', 1024 + index % 60000, '', 0, 'NONE', 'UDP'))
+        else:
+            snapshot.append(('10.0.0.1', 1024 + index % 60000, rng.choice(remotes),
+                             rng.choice((80, 443, 8080)), rng.choice(statuses), 'TCP'))
+    return snapshot
+
+def churn(snapshot, fraction, rng):
+    """Replace a fraction of the sockets with new ones, as between two samples"""
+    snapshot = list(snapshot)
+    for _ in range(int(len(snapshot) * fraction)):
+        index = rng.randrange(len(snapshot))
+        local_ip, local_port, remote_ip, remote_port, status, protocol = snapshot[index]
+        snapshot[index] = (local_ip, rng.randrange(1024, 65536), remote_ip or '', remote_port, status, protocol)
+    return snapshot
+
+def time_updates(tracker, snapshots):
+    tracker.update(snapshots[0])  # Warm up: every socket is new on the first sample
+    start = time.perf_counter()
+    for snapshot in snapshots[1:]:
+        tracker.update(snapshot)
+    return (time.perf_counter() - start) / (len(snapshots) - 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sockets', type=int, nargs='+', default=[100000, 200000])
+    parser.add_argument('--rounds', type=int, default=5, help="timed updates per tracker")
+    parser.add_argument('--churn', type=float, default=0.01, help="fraction of sockets replaced per sample")
+    parser.add_argument('--shards', type=int, default=0, metavar='N',
+                        help="also time the sharded tracker with N worker processes")
+    args = parser.parse_args()
+
+    from batchtracker import BatchConnectionTracker
+
+    for sockets in args.sockets:
+        rng = random.Random(sockets)
+        snapshots = [make_snapshot(sockets)]
+        for _ in range(args.rounds):
+            snapshots.append(churn(snapshots[-1], args.churn, rng))
+
+        python_time = time_updates(ConnectionTracker(), snapshots)
+        batch_time = time_updates(BatchConnectionTracker(), snapshots)
+        print(f"{sockets:>8} sockets: python {python_time * 1000:8.1f}ms/update, "
+              f"numpy {batch_time * 1000:8.1f}ms/update, speedup {python_time / batch_time:.1f}x")
+        if args.shards:
+            from shardedtracker import ShardedConnectionTracker
+            tracker = ShardedConnectionTracker(args.shards)
+            try:
+                sharded_time = time_updates(tracker, snapshots)
+            finally:
+                tracker.close()
+            print(f"{'':>8}          {args.shards} shards {sharded_time * 1000:8.1f}ms/update, "
+                  f"speedup {python_time / sharded_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Capture filters decide which sockets are tracked at all.
+
+A filter is an expression such as
+
+    not loopback and not (udp and remote port 53) and not local port 9100-9110
+
+built from these primitives, combined with and/or/not and parentheses:
+
+    tcp, udp                      protocol
+    ip4, ip6                      address family of the local address
+    loopback                      local address is 127.0.0.0/8 or ::1
+    [local|remote] net CIDR       address inside a network
+    [local|remote] host IP        a single address
+    [local|remote] port N[-M]     port or inclusive port range
+    status NAME                   connection status, e.g. ESTABLISHED
+
+Without local/remote a primitive matches either end. IPv4-mapped IPv6
+addresses (::ffff:a.b.c.d, used by dual-stack sockets) match IPv4
+networks, including loopback. Sockets matching the
+expression are kept. The expression is compiled once into a Python
+function, and the protocols and address families it can match are used
+to narrow the kernel query.
+"""
+import ipaddress
+import re
+
+TOKEN = re.compile(r'\s*(?:(\()|(\))|([^\s()]+))')
+ARGUMENT_PRIMITIVES = ('net', 'host', 'port', 'status')
+NET_CACHE_LIMIT = 65536
+
+class CaptureFilter:
+    """
+    A compiled capture filter.
+
+    Attributes:
+        expression: The source expression
+        matches: Function (protocol, local_ip, local_port, remote_ip, remote_port,
+            status) -> bool
+        kinds: psutil.net_connections kinds per protocol ('TCP'/'UDP'); a
+            protocol that can never match is left out
+    """
+    def __init__(self, expression, matches, kinds):
+        self.expression = expression
+        self.matches = matches
+        self.kinds = kinds
+
+    def __repr__(self):
+        return f"CaptureFilter({self.expression!r})"
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if not match:
+            raise ValueError(f"Invalid capture filter near: {expression[position:]!r}")
+        tokens.append(match.group(1) or match.group(2) or match.group(3))
+        position = match.end()
+    return tokens
+
+class Parser:
+    """Recursive-descent parser producing ('and'|'or', a, b), ('not', a) and primitive tuples"""
+    def __init__(self, expression):
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position].lower() if self.position < len(self.tokens) else None
+
+    def take(self, what=None):
+        if self.position >= len(self.tokens):
+            raise ValueError(f"Capture filter ends unexpectedly; expected {what or 'more input'}")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Capture filter is empty")
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError(f"Unexpected {self.tokens[self.position]!r} in capture filter")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek() == 'or':
+            self.take()
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.peek() == 'and':
+            self.take()
+            node = ('and', node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        token = self.peek()
+        if token == 'not':
+            self.take()
+            return ('not', self.parse_not())
+        if token == '(':
+            self.take()
+            node = self.parse_or()
+            if self.take("')'") != ')':
+                raise ValueError("Missing ')' in capture filter")
+            return node
+        return self.parse_primitive()
+
+    def parse_primitive(self):
+        token = self.take('a filter primitive').lower()
+        if token in ('tcp', 'udp'):
+            return ('protocol', token.upper())
+        if token in ('ip4', 'ip6'):
+            return ('family', token)
+        if token == 'loopback':
+            return ('or', ('net', 'local', ipaddress.ip_network('127.0.0.0/8')),
+                    ('net', 'local', ipaddress.ip_network('::1/128')))
+
+        side = 'any'
+        if token in ('local', 'remote'):
+            side = token
+            token = self.take(f"net, host or port after {side!r}").lower()
+        if token not in ARGUMENT_PRIMITIVES:
+            raise ValueError(f"Unknown capture filter primitive {token!r}")
+        argument = self.take(f"an argument for {token!r}")
+
+        try:
+            if token in ('net', 'host'):
+                network = ipaddress.ip_network(argument, strict=False)
+                if token == 'host' and network.num_addresses != 1:
+                    raise ValueError(f"{argument!r} is not a single host")
+                return ('net', side, network)
+            if token == 'port':
+                low, separator, high = argument.partition('-')
+                if separator and not high:
+                    raise ValueError(f"Port range {argument!r} has no upper bound")
+                low, high = int(low), int(high or low)
+                if not 0 <= low <= high <= 65535:
+                    raise ValueError(f"Invalid port range {argument!r}")
+                return ('port', side, low, high)
+        except ValueError as e:
+            raise ValueError(f"Invalid capture filter argument: {e}") from None
+        if side != 'any':
+            raise ValueError("'status' cannot be combined with local/remote")
+        return ('status', argument.upper())
+
+def network_matcher(network):
+    """
+    Return a memoised ip-string -> bool test for one network.
+    IPv4-mapped IPv6 addresses are tested as IPv4 against IPv4 networks.
+    """
+    cache = {}
+
+    def matches(ip):
+        result = cache.get(ip)
+        if result is None:
+            if len(cache) >= NET_CACHE_LIMIT:
+                cache.clear()
+            try:
+                address = ipaddress.ip_address(ip)
+                if network.version == 4 and address.version == 6 and address.ipv4_mapped:
+                    address = address.ipv4_mapped
+                result = address in network
+            except ValueError:
+                result = False
+            cache[ip] = result
+        return result
+    return matches
+
+def generate(node, namespace):
+    """Translate a parsed filter into a Python expression over the predicate's arguments"""
+    kind = node[0]
+    if kind in ('and', 'or'):
+        return f"({generate(node[1], namespace)} {kind} {generate(node[2], namespace)})"
+    if kind == 'not':
+        return f"(not {generate(node[1], namespace)})"
+    if kind == 'protocol':
+        return f"(protocol == {node[1]!r})"
+    if kind == 'family':
+        return "(':' not in local_ip)" if node[1] == 'ip4' else "(':' in local_ip)"
+    if kind == 'status':
+        return f"(status == {node[1]!r})"
+
+    side = node[1]
+    if kind == 'net':
+        name = f"_net{len(namespace)}"
+        namespace[name] = network_matcher(node[2])
+        tests = {'local': f"{name}(local_ip)", 'remote': f"{name}(remote_ip)"}
+    else:
+        low, high = node[2], node[3]
+        if low == high:
+            tests = {'local': f"local_port == {low}", 'remote': f"remote_port == {low}"}
+        else:
+            tests = {'local': f"{low} <= local_port <= {high}", 'remote': f"{low} <= remote_port <= {high}"}
+    if side == 'any':
+        return f"({tests['local']} or {tests['remote']})"
+    return f"({tests[side]})"
+
+def evaluate_partially(node, protocol, family):
+    """
+    Evaluate a filter knowing only the protocol and address family.
+    Returns True/False when decided, None when it depends on other fields.
+    """
+    kind = node[0]
+    if kind == 'protocol':
+        return node[1] == protocol
+    if kind == 'family':
+        return node[1] == family
+    if kind == 'not':
+        result = evaluate_partially(node[1], protocol, family)
+        return None if result is None else not result
+    if kind in ('and', 'or'):
+        left = evaluate_partially(node[1], protocol, family)
+        right = evaluate_partially(node[2], protocol, family)
+        if kind == 'and':
+            if left is False or right is False:
+                return False
+            return True if left and right else None
+        if left or right:
+            return True
+        return False if left is False and right is False else None
+    return None
+
+def kernel_kinds(tree):
+    """Work out the narrowest psutil kinds that can still return matching sockets"""
+    kinds = {}
+    for protocol in ('TCP', 'UDP'):
+        families = [family for family in ('ip4', 'ip6')
+                    if evaluate_partially(tree, protocol, family) is not False]
+        if len(families) == 2:
+            kinds[protocol] = protocol.lower()
+        elif families:
+            kinds[protocol] = protocol.lower() + families[0][-1]
+    return kinds
+
+def compile_filter(expression):
+    """
+    Compile a capture filter expression.
+    Returns:
+        CaptureFilter: The compiled filter
+    Raises:
+        ValueError: If the expression is invalid
+    """
+    tree = Parser(expression).parse()
+    namespace = {}
+    source = generate(tree, namespace)
+    code = compile(f"lambda protocol, local_ip, local_port, remote_ip, remote_port, status: {source}",
+                   '<capture filter>', 'eval')
+    matches = eval(code, namespace)
+    return CaptureFilter(expression, matches, kernel_kinds(tree))
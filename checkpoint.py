@@ -0,0 +1,500 @@
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from operator import itemgetter
+from pathlib import Path
+
+from networkmonitor import new_connection_record
+from statehistory import MAX_DELTA, STATUSES, StateHistory, status_code
+
+# File layout (native byte order, recorded in the header):
+#   header, header CRC32
+#   status names      '\0'-separated, so stored status codes can be remapped
+#   rows              one ROW per connection, TCP first, in discovery order
+#   index             per protocol: CRC32 of each key, sorted, and the matching row numbers
+#   strings           per row: key, local IP, remote IP, first status, current status
+#   histories         per row with a history: HISTORY, status codes, millisecond deltas
+# Sections start on 8-byte boundaries. The body CRC32 covers everything after the header.
+MAGIC = b'NCMCKPT1'
+VERSION = 1
+HEADER = struct.Struct('=8sIIdQQQQ7Q')
+HEADER_CRC = struct.Struct('=I')
+ROW = struct.Struct('=QHHHqqQQI')
+HISTORY = struct.Struct('=ddI')
+
+# Timestamps are stored as microseconds since this naive epoch so that the
+# restored datetimes are exactly the ones that were saved
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_micros(moment):
+    return (moment - EPOCH) // MICROSECOND
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+def key_hash(key):
+    return zlib.crc32(key.encode('utf-8'))
+
+def padding(size):
+    return b'\0' * (-size % 8)
+
+# Fields of a connection record that a checkpoint stores
+RECORD_FIELDS = itemgetter('info', 'status', 'first_seen', 'last_seen', 'count', 'history')
+
+def encode_history(history, size, last_change):
+    """Encode the first `size` entries of a history, as they were when `last_change` was current"""
+    deltas = array('Q', history.deltas[:size])
+    return HISTORY.pack(history.start, last_change, size) + \
+        bytes(history.states[:size]) + deltas.tobytes()
+
+class TrackerCapture:
+    """
+    What a checkpoint needs from a tracker at one moment, taken cheaply on
+    the tracking thread so that encoding and writing can happen elsewhere.
+
+    Records are not copied: their fields are immutable apart from the
+    status history, which only ever grows, so its current length and last
+    change time are enough. Records of a resumed tracker that are still in
+    the mapped checkpoint are not touched at all; they are copied from that
+    file when the capture is written.
+    """
+    def __init__(self, tracker):
+        tracker.sync()
+        self.saved_at = time.time()
+        self.get_connection_key = tracker.get_connection_key
+        self.totals = {'TCP': tracker.total_tcp_tracked, 'UDP': tracker.total_udp_tracked}
+        self.parts = {}
+        for protocol, connections in (('TCP', tracker.tcp_connections), ('UDP', tracker.udp_connections)):
+            if isinstance(connections, RestoredConnections):
+                saved, restored = connections.checkpoint, set(connections.restored)
+                rows = list(map(RECORD_FIELDS, dict.values(connections)))
+            else:
+                saved, restored = None, None
+                rows = list(map(RECORD_FIELDS, connections.values()))
+            for index in [index for index, row in enumerate(rows) if row[5] is not None]:
+                history = rows[index][5]
+                rows[index] = rows[index][:5] + ((history, len(history.states), history.last_change),)
+            self.parts[protocol] = (saved, restored, rows)
+
+    def encode(self, row):
+        """
+        Encode a captured record.
+        Returns:
+            tuple: (key hash, strings, local port, remote port, first seen,
+                last seen, count, encoded history)
+        """
+        info, status, first_seen, last_seen, count, history = row
+        key = self.get_connection_key(info)
+        text = '\0'.join((key, info[0], info[2], info[4], status)).encode('utf-8')
+        return (key_hash(key), text, info[1], info[3], to_micros(first_seen), to_micros(last_seen),
+                count, encode_history(*history) if history else b'')
+
+    def encoded_rows(self, protocol):
+        """Yield the encoded records of a protocol in discovery order"""
+        saved, restored, rows = self.parts[protocol]
+        rows = [row for row in rows if row[2]]
+        if saved is None:
+            yield from map(self.encode, rows)
+            return
+
+        # As RestoredConnections.items(): saved records first, then new ones
+        restored_rows = {}
+        new_rows = []
+        for row in rows:
+            key = self.get_connection_key(row[0])
+            if key in restored:
+                restored_rows[key.encode('utf-8')] = row
+            else:
+                new_rows.append(row)
+        for key, encoded in saved.raw_records(protocol):
+            row = restored_rows.get(key)
+            yield encoded if row is None else self.encode(row)
+        yield from map(self.encode, new_rows)
+
+def write_checkpoint(tracker, path):
+    """
+    Write the connection records of a tracker to a checkpoint file. The file
+    is written next to `path` and renamed into place, so a crash never
+    leaves a partial checkpoint under the final name.
+
+    Args:
+        tracker: ConnectionTracker (or a tracker with the same record views),
+            or a TrackerCapture of one
+        path: Path of the checkpoint file
+    Returns:
+        int: Number of connections written
+    """
+    capture = tracker if isinstance(tracker, TrackerCapture) else TrackerCapture(tracker)
+    rows = bytearray()
+    strings = bytearray()
+    histories = bytearray()
+    indexes = []
+    row_counts = []
+    for protocol in ('TCP', 'UDP'):
+        first_row = len(rows) // ROW.size
+        hashes = array('I')
+        for hashed, text, local_port, remote_port, first_seen, last_seen, count, history in \
+                capture.encoded_rows(protocol):
+            rows += ROW.pack(len(strings), len(text), local_port, remote_port,
+                             first_seen, last_seen, count, len(histories), len(history))
+            strings += text
+            histories += history
+            hashes.append(hashed)
+        order = sorted(range(len(hashes)), key=hashes.__getitem__)
+        indexes.append(array('I', map(hashes.__getitem__, order)).tobytes())
+        indexes.append(array('I', (first_row + position for position in order)).tobytes())
+        row_counts.append(len(hashes))
+
+    sections = ['\0'.join(STATUSES).encode('utf-8'), bytes(rows), b''.join(indexes), bytes(strings), bytes(histories)]
+    offsets = []
+    body = []
+    position = HEADER.size + HEADER_CRC.size
+    position += len(padding(position))
+    crc = 0
+    for section in sections:
+        offsets.append(position)
+        for part in (section, padding(len(section))):
+            body.append(part)
+            crc = zlib.crc32(part, crc)
+            position += len(part)
+
+    header = HEADER.pack(MAGIC, VERSION, sys.byteorder == 'little', capture.saved_at,
+                         capture.totals['TCP'], capture.totals['UDP'], row_counts[0], row_counts[1],
+                         *offsets, position, crc)
+    header += HEADER_CRC.pack(zlib.crc32(header))
+    header += padding(len(header))
+
+    path = Path(path)
+    partial = path.with_name(path.name + '.partial')
+    try:
+        with partial.open('wb') as f:
+            f.write(header)
+            for part in body:
+                f.write(part)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+    except BaseException:
+        try:
+            partial.unlink()
+        except OSError:
+            pass
+        raise
+    return sum(row_counts)
+
+class Checkpoint:
+    """
+    A checkpoint file mapped into memory. Opening it validates the checksums
+    but decodes nothing else; records are decoded one at a time on request.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with self.path.open('rb') as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"{self.path.name} is empty") from None
+        try:
+            self.validate()
+        except (ValueError, struct.error):
+            self.map.close()
+            raise
+
+    def validate(self):
+        if len(self.map) < HEADER.size + HEADER_CRC.size:
+            raise ValueError(f"{self.path.name} is truncated")
+        fields = HEADER.unpack_from(self.map, 0)
+        magic, version, little_endian = fields[:3]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path.name} is not a version {VERSION} checkpoint")
+        if HEADER_CRC.unpack_from(self.map, HEADER.size)[0] != zlib.crc32(self.map[:HEADER.size]):
+            raise ValueError(f"{self.path.name} has a damaged header")
+        if bool(little_endian) != (sys.byteorder == 'little'):
+            raise ValueError(f"{self.path.name} was written on a machine with another byte order")
+        (self.saved_at, total_tcp, total_udp, tcp_rows, udp_rows,
+         statuses_offset, rows_offset, index_offset, strings_offset, histories_offset,
+         end, crc) = fields[3:]
+        if end != len(self.map):
+            raise ValueError(f"{self.path.name} is truncated")
+        view = memoryview(self.map)
+        try:
+            valid = zlib.crc32(view[statuses_offset:end]) == crc
+        finally:
+            view.release()
+        if not valid:
+            raise ValueError(f"{self.path.name} failed its checksum")
+
+        self.totals = {'TCP': total_tcp, 'UDP': total_udp}
+        self.row_ranges = {'TCP': (0, tcp_rows), 'UDP': (tcp_rows, tcp_rows + udp_rows)}
+        self.rows_offset = rows_offset
+        self.strings_offset = strings_offset
+        self.histories_offset = histories_offset
+        names = self.map[statuses_offset:rows_offset].rstrip(b'\0').decode('utf-8').split('\0')
+        # Status codes depend on registration order; translate the file's codes to ours
+        self.status_table = bytes(status_code(name) for name in names).ljust(256, b'\0')
+
+        self.indexes = {}
+        position = index_offset
+        for protocol, count in (('TCP', tcp_rows), ('UDP', udp_rows)):
+            # Copied out of the map: a plain array is much faster to bisect than a memoryview
+            hashes = array('I')
+            hashes.frombytes(self.map[position:position + 4 * count])
+            rows = array('I')
+            rows.frombytes(self.map[position + 4 * count:position + 8 * count])
+            self.indexes[protocol] = (hashes, rows)
+            position += 8 * count
+
+    def __len__(self):
+        return sum(end - start for start, end in self.row_ranges.values())
+
+    def decode(self, row, protocol):
+        """
+        Decode one row.
+        Returns:
+            tuple: (key, connection record)
+        """
+        (text_offset, text_size, local_port, remote_port, first_seen, last_seen,
+         count, history_offset, history_size) = ROW.unpack_from(self.map, self.rows_offset + row * ROW.size)
+        start = self.strings_offset + text_offset
+        key, local_ip, remote_ip, first_status, status = \
+            self.map[start:start + text_size].decode('utf-8').split('\0')
+        record = new_connection_record()
+        record.update({
+            'count': count,
+            'first_seen': from_micros(first_seen),
+            'last_seen': from_micros(last_seen),
+            'info': (local_ip, local_port, remote_ip, remote_port, first_status, protocol),
+            'status': status,
+        })
+        if history_size:
+            record['history'] = self.decode_history(self.histories_offset + history_offset)
+        return key, record
+
+    def decode_history(self, position):
+        start, last_change, size = HISTORY.unpack_from(self.map, position)
+        position += HISTORY.size
+        history = StateHistory.__new__(StateHistory)
+        history.start = start
+        history.last_change = last_change
+        history.states = bytearray(self.map[position:position + size].translate(self.status_table))
+        deltas = array('Q')
+        deltas.frombytes(self.map[position + size:position + size + 8 * size])
+        history.deltas = array('I', (min(delta, MAX_DELTA) for delta in deltas))
+        return history
+
+    def find(self, protocol, key):
+        """Return the record saved for a connection key, or None"""
+        hashes, rows = self.indexes[protocol]
+        wanted = key_hash(key)
+        position = bisect_left(hashes, wanted)
+        while position < len(hashes) and hashes[position] == wanted:
+            found, record = self.decode(rows[position], protocol)
+            if found == key:
+                return record
+            position += 1
+        return None
+
+    def raw_records(self, protocol):
+        """
+        Yield (UTF-8 key, encoded record) for every saved connection of a
+        protocol, in discovery order, without decoding the records. The
+        encoded record is in the form TrackerCapture.encode returns.
+        """
+        start, end = self.row_ranges[protocol]
+        for row in range(start, end):
+            (text_offset, text_size, local_port, remote_port, first_seen, last_seen,
+             count, history_offset, history_size) = ROW.unpack_from(self.map, self.rows_offset + row * ROW.size)
+            text_start = self.strings_offset + text_offset
+            text = self.map[text_start:text_start + text_size]
+            key = text[:text.index(b'\0')]
+            history = b''
+            if history_size:
+                position = self.histories_offset + history_offset
+                size = HISTORY.unpack_from(self.map, position)[2]
+                states = position + HISTORY.size
+                history = self.map[position:states] + \
+                    self.map[states:states + size].translate(self.status_table) + \
+                    self.map[states + size:position + history_size]
+            yield key, (zlib.crc32(key), text, local_port, remote_port, first_seen, last_seen, count, history)
+
+    def records(self, protocol):
+        """Yield (key, record) for every saved connection of a protocol, in discovery order"""
+        start, end = self.row_ranges[protocol]
+        for row in range(start, end):
+            yield self.decode(row, protocol)
+
+    def close(self):
+        self.map.close()
+
+class RestoredConnections(dict):
+    """
+    tcp_connections/udp_connections of a tracker resumed from a checkpoint.
+
+    Saved records stay in the mapped file until their connection is seen
+    again (or looked up), and are then copied into the dict. Iteration
+    yields the saved connections in their original order followed by the
+    ones discovered since, like the dict of a tracker that never stopped.
+    Saved records that have not been copied in are decoded for each
+    iteration, so changes made to them are not stored.
+    """
+    def __init__(self, checkpoint, protocol):
+        super().__init__()
+        self.checkpoint = checkpoint
+        self.protocol = protocol
+        self.restored = set()
+
+    def restore(self, key):
+        record = self.checkpoint.find(self.protocol, key)
+        if record is not None:
+            dict.__setitem__(self, key, record)
+            self.restored.add(key)
+        return record
+
+    def __missing__(self, key):
+        record = self.restore(key)
+        if record is None:
+            record = new_connection_record()
+            dict.__setitem__(self, key, record)
+        return record
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        record = self.restore(key)
+        return default if record is None else record
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self.checkpoint.find(self.protocol, key) is not None
+
+    def items(self):
+        for key, record in self.checkpoint.records(self.protocol):
+            if key in self.restored:
+                record = dict.__getitem__(self, key)
+            yield key, record
+        for key, record in dict.items(self):
+            if key not in self.restored:
+                yield key, record
+
+    def keys(self):
+        return (key for key, _ in self.items())
+
+    def values(self):
+        return (record for _, record in self.items())
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        start, end = self.checkpoint.row_ranges[self.protocol]
+        return end - start + dict.__len__(self) - len(self.restored)
+
+def resume_tracker(tracker, checkpoint):
+    """Continue an empty ConnectionTracker from a checkpoint"""
+    tracker.tcp_connections = RestoredConnections(checkpoint, 'TCP')
+    tracker.udp_connections = RestoredConnections(checkpoint, 'UDP')
+    tracker.total_tcp_tracked = checkpoint.totals['TCP']
+    tracker.total_udp_tracked = checkpoint.totals['UDP']
+
+class CheckpointManager:
+    """
+    Writes a checkpoint of the tracker every `interval` seconds (0 disables
+    periodic checkpoints) and keeps the newest `keep` files. Periodic
+    checkpoints are encoded and written in a background thread; only the
+    TrackerCapture is taken on the tracking thread. `report` receives a line
+    with the save times once a checkpoint is written.
+    """
+    def __init__(self, directory, interval=300, keep=2, report=print):
+        self.directory = Path(directory)
+        self.interval = interval
+        self.keep = keep
+        self.report = report
+        self.last_save = time.time()
+        self.writer = None
+
+    def checkpoint_files(self):
+        """Checkpoint files, newest first"""
+        return sorted(self.directory.glob('checkpoint_*.ncmc'), reverse=True)
+
+    def latest(self):
+        """
+        Open the newest checkpoint that passes validation.
+        Returns:
+            Checkpoint or None
+        """
+        for path in self.checkpoint_files():
+            try:
+                return Checkpoint(path)
+            except (OSError, ValueError) as e:
+                print(f"Skipping checkpoint {path.name}: {e}")
+        return None
+
+    def due(self):
+        if self.writer is not None and self.writer.is_alive():
+            return False
+        return self.interval > 0 and time.time() - self.last_save >= self.interval
+
+    def save(self, tracker, background=False):
+        """
+        Write a new checkpoint and remove the older ones. Waits for a
+        checkpoint still being written in the background first.
+
+        Args:
+            tracker: The tracker; must be called from the thread that updates it
+            background: If True, return once the tracker is captured and write
+                the checkpoint in a background thread
+        Returns:
+            bool: True if the checkpoint was written (or, in the background, started)
+        """
+        self.wait()
+        self.last_save = time.time()
+        path = self.directory / f"checkpoint_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.ncmc"
+        capture_start = time.perf_counter()
+        try:
+            capture = TrackerCapture(tracker)
+        except Exception as e:
+            # A failed checkpoint must not stop monitoring (or the final save)
+            print(f"Error writing checkpoint: {e}")
+            return False
+        capture_time = time.perf_counter() - capture_start
+        if not background:
+            return self.write(capture, path, capture_time)
+        self.writer = threading.Thread(target=self.write, args=(capture, path, capture_time),
+                                       name="netconmon-checkpoint", daemon=True)
+        self.writer.start()
+        return True
+
+    def wait(self):
+        """Wait for a checkpoint being written in the background"""
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+    def write(self, capture, path, capture_time):
+        write_start = time.perf_counter()
+        try:
+            count = write_checkpoint(capture, path)
+        except Exception as e:
+            print(f"Error writing checkpoint: {e}")
+            return False
+        try:
+            self.report(f"Checkpoint of {count} connections saved in "
+                        f"{(capture_time + time.perf_counter() - write_start) * 1000:.0f} ms "
+                        f"({capture_time * 1000:.0f} ms on the tracking thread)")
+        except Exception:
+            # The GUI may have closed in the meantime
+            pass
+        for old in self.checkpoint_files()[self.keep:]:
+            try:
+                old.unlink()
+            except OSError:
+                # Still mapped by this process on Windows; removed by a later save
+                pass
+        return True
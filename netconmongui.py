@@ -1,67 +1,190 @@
+import time
+_STARTUP_BEGIN = time.perf_counter()  # Taken before tkinter is imported
+
 import tkinter as tk
-from tkinter import ttk, scrolledtext, PhotoImage, messagebox, filedialog
-from PIL import Image, ImageTk
+from tkinter import ttk, scrolledtext, messagebox, filedialog
 import threading
+import argparse
 import sys
 import os
-import time
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-import networkmonitor
+
+# PIL and networkmonitor (which pulls in psutil) are imported lazily so the
+# main window can be drawn before the heavier dependencies are loaded.
+
+_image_cache = {}
+
+def load_image(image_path):
+    """
+    Load an image once and share it between all windows.
+    Returns:
+        PIL.Image.Image: The decoded image
+    """
+    from PIL import Image
+
+    key = str(image_path)
+    if key not in _image_cache:
+        image = Image.open(image_path)
+        image.load()
+        _image_cache[key] = image
+    return _image_cache[key]
 
 class BackgroundFrame(ttk.Frame):
     """A frame that supports a background image that scales with the window"""
+    SIZE_BUCKET = 16        # pixels; resized images are cached per bucket
+    SETTLE_DELAY = 150      # ms without <Configure> before a high-quality resize
+    FIRST_DRAW_DELAY = 100  # ms after the window first appears before the image is decoded
+    MAX_CACHED_SIZES = 8
+
     def __init__(self, parent, image_path, *args, **kwargs):
         ttk.Frame.__init__(self, parent, *args, **kwargs)
         
-        try:
-            # Load original image
-            self.original_image = Image.open(image_path)
-            self.aspect_ratio = self.original_image.width / self.original_image.height
-            
-            # Create initial photo image
-            self.background_image = None
-            self.background_label = tk.Label(self)
-            self.background_label.place(x=0, y=0, relwidth=1, relheight=1)
-            
-            # Bind resize event
-            self.bind('<Configure>', self.resize_image)
-            
-            # Make sure other widgets appear on top
-            self.background_label.lower()
-            
-        except Exception as e:
-            print(f"Could not load background image: {e}")
-    
+        self.image_path = image_path
+        self.original_image = None
+        self.aspect_ratio = None
+        self.background_image = None
+        self.pending_resize = None
+        self.pending_load = None
+        self.current_size = None
+        # (width, height, high_quality) -> PhotoImage
+        self.resize_cache = OrderedDict()
+        
+        # Plain black until the image is decoded, which happens after the first paint
+        self.background_label = tk.Label(self, bg='black')
+        self.background_label.place(x=0, y=0, relwidth=1, relheight=1)
+        
+        # Bind resize event
+        self.bind('<Configure>', self.resize_image)
+        
+        # Make sure other widgets appear on top
+        self.background_label.lower()
+
+    def load_original(self):
+        """Decode the background image on first use. Returns False if unavailable."""
+        if self.original_image is None and self.image_path is not None:
+            try:
+                self.original_image = load_image(self.image_path)
+                self.aspect_ratio = self.original_image.width / self.original_image.height
+            except Exception as e:
+                print(f"Could not load background image: {e}")
+                self.image_path = None
+        return self.original_image is not None
+
+    def fit_size(self, width, height):
+        """Calculate the bucketed image size that maintains aspect ratio for the window"""
+        new_ratio = width / height
+        
+        if new_ratio > self.aspect_ratio:
+            # Window is wider than image ratio
+            new_height = height
+            new_width = int(height * self.aspect_ratio)
+        else:
+            # Window is taller than image ratio
+            new_width = width
+            new_height = int(width / self.aspect_ratio)
+        
+        # Round up to the next bucket so nearby sizes share a cached image
+        bucket = self.SIZE_BUCKET
+        new_width = max(bucket, -(-new_width // bucket) * bucket)
+        new_height = max(bucket, -(-new_height // bucket) * bucket)
+        return new_width, new_height
+
+    def get_resized(self, size, high_quality):
+        """Return a cached PhotoImage for the given size, rendering it if needed"""
+        from PIL import Image, ImageTk
+
+        # A LANCZOS render is always preferable if we already have it
+        for key in ((size[0], size[1], True), (size[0], size[1], high_quality)):
+            photo = self.resize_cache.get(key)
+            if photo is not None:
+                self.resize_cache.move_to_end(key)
+                return photo
+        
+        resample = Image.Resampling.LANCZOS if high_quality else Image.Resampling.BILINEAR
+        photo = ImageTk.PhotoImage(self.original_image.resize(size, resample))
+        self.resize_cache[(size[0], size[1], high_quality)] = photo
+        if len(self.resize_cache) > self.MAX_CACHED_SIZES:
+            self.resize_cache.popitem(last=False)
+        return photo
+
+    def show_image(self, photo):
+        self.background_image = photo
+        self.background_label.configure(image=self.background_image)
+
     def resize_image(self, event):
-        """Resize the background image to maintain aspect ratio and fill the window"""
-        if self.original_image:
-            # Get new size
-            width = event.width
-            height = event.height
-            
-            # Calculate new size maintaining aspect ratio
-            new_ratio = width / height
-            
-            if new_ratio > self.aspect_ratio:
-                # Window is wider than image ratio
-                new_height = height
-                new_width = int(height * self.aspect_ratio)
-            else:
-                # Window is taller than image ratio
-                new_width = width
-                new_height = int(width / self.aspect_ratio)
-            
-            # Resize image
-            resized_image = self.original_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            self.background_image = ImageTk.PhotoImage(resized_image)
-            self.background_label.configure(image=self.background_image)
+        """
+        Resize the background image to maintain aspect ratio and fill the window.
+        While the window is being dragged a fast filter is used; the LANCZOS
+        render is deferred until the size has settled.
+        """
+        if event.width < 2 or event.height < 2:
+            return
+        if self.original_image is None:
+            # Let the window appear first; decoding the image is not on the startup path
+            if self.pending_load is None and self.image_path is not None:
+                self.pending_load = self.after(self.FIRST_DRAW_DELAY, self.first_draw)
+            return
+        self.draw(event.width, event.height)
+
+    def first_draw(self):
+        """Decode the image and draw it at the current window size"""
+        width, height = self.winfo_width(), self.winfo_height()
+        if width >= 2 and height >= 2 and self.load_original():
+            self.draw(width, height)
+
+    def draw(self, width, height):
+        """Show a fast preview at the new size and schedule the LANCZOS render"""
+        size = self.fit_size(width, height)
+        if size == self.current_size:
+            return
+        self.current_size = size
+        
+        self.show_image(self.get_resized(size, high_quality=False))
+        
+        if self.pending_resize is not None:
+            self.after_cancel(self.pending_resize)
+        self.pending_resize = self.after(self.SETTLE_DELAY, self.finish_resize)
+
+    def finish_resize(self):
+        """Replace the fast preview with a high-quality render once resizing stops"""
+        self.pending_resize = None
+        if self.current_size is not None:
+            self.show_image(self.get_resized(self.current_size, high_quality=True))
+
+class Sparkline(tk.Canvas):
+    """A small line chart of recent values, drawn as a single canvas item"""
+    def __init__(self, parent, width=120, height=24, color='#00ff00', **kwargs):
+        tk.Canvas.__init__(self, parent, width=width, height=height, bg='black',
+                           highlightthickness=0, **kwargs)
+        self.chart_width = width
+        self.chart_height = height
+        self.values = None
+        self.line = self.create_line(0, height - 1, width, height - 1, fill=color)
+
+    def set_values(self, values):
+        """Redraw the line, skipping the work if nothing changed"""
+        values = tuple(values)
+        if values == self.values or len(values) < 2:
+            return
+        self.values = values
+        
+        peak = max(values) or 1
+        step = (self.chart_width - 1) / (len(values) - 1)
+        scale = (self.chart_height - 2) / peak
+        coords = []
+        for index, value in enumerate(values):
+            coords.extend((index * step, self.chart_height - 1 - value * scale))
+        self.coords(self.line, *coords)
 
 class MonitorWindow:
-    def __init__(self):
-        self.window = tk.Tk()
+    def __init__(self, parent, shards=None):
+        self.window = tk.Toplevel(parent)
+        self.shards = shards  # worker processes for sharded tracking, if any
         self.window.title("NetConMon - Network Connection Monitor")
         self.window.geometry("800x600")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
         
         # Create background frame
         self.main_frame = BackgroundFrame(self.window, "netconmon.png")
@@ -83,7 +206,11 @@ class MonitorWindow:
             fg='white',
             bg='black'
         )
-        self.tcp_status_label.pack(side=tk.LEFT, padx=10)
+        self.tcp_status_label.pack(side=tk.LEFT, padx=(10, 2))
+        
+        # New TCP connections per second over the last minute
+        self.tcp_sparkline = Sparkline(self.protocol_frame)
+        self.tcp_sparkline.pack(side=tk.LEFT, padx=(2, 10))
         
         # UDP Status label
         self.udp_status_label = tk.Label(
@@ -93,7 +220,11 @@ class MonitorWindow:
             fg='white',
             bg='black'
         )
-        self.udp_status_label.pack(side=tk.LEFT, padx=10)
+        self.udp_status_label.pack(side=tk.LEFT, padx=(10, 2))
+        
+        # New UDP connections per second over the last minute
+        self.udp_sparkline = Sparkline(self.protocol_frame, color='#00bfff')
+        self.udp_sparkline.pack(side=tk.LEFT, padx=(2, 10))
         
         # Total Status label
         self.total_status_label = tk.Label(
@@ -105,6 +236,26 @@ class MonitorWindow:
         )
         self.total_status_label.pack(pady=2)
         
+        # Distinct remotes label (HyperLogLog estimates)
+        self.remotes_label = tk.Label(
+            labels_frame,
+            text="Distinct remote IPs: -",
+            font=("Arial", 10),
+            fg='white',
+            bg='black'
+        )
+        self.remotes_label.pack(pady=2)
+        
+        # Samples identical to the previous one are not reprocessed
+        self.skipped_label = tk.Label(
+            labels_frame,
+            text="Unchanged samples skipped: 0",
+            font=("Arial", 10),
+            fg='white',
+            bg='black'
+        )
+        self.skipped_label.pack(pady=2)
+        
         # Backup status label
         self.backup_label = tk.Label(
             labels_frame,
@@ -119,6 +270,29 @@ class MonitorWindow:
         log_frame = tk.Frame(self.main_frame, bg='black')
         log_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=5)
         
+        # Capture filter, applied before connections are tracked
+        capture_frame = tk.Frame(log_frame, bg='black')
+        capture_frame.pack(fill=tk.X, pady=2)
+        
+        tk.Label(
+            capture_frame,
+            text="Capture filter:",
+            font=("Arial", 10),
+            fg='white',
+            bg='black'
+        ).pack(side=tk.LEFT, padx=5)
+        
+        self.capture_filter_text = tk.StringVar()
+        self.capture_filter_entry = tk.Entry(
+            capture_frame,
+            textvariable=self.capture_filter_text,
+            font=("Arial", 10),
+            bg='#1a1a1a',
+            fg='white',
+            insertbackground='white'
+        )
+        self.capture_filter_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        
         # Protocol filter
         filter_frame = tk.Frame(log_frame, bg='black')
         filter_frame.pack(fill=tk.X, pady=2)
@@ -151,6 +325,31 @@ class MonitorWindow:
         )
         udp_check.pack(side=tk.LEFT, padx=5)
         
+        # tcp_info enrichment is only available through Linux sock_diag
+        self.collect_tcp_metrics = tk.BooleanVar(value=False)
+        if sys.platform.startswith('linux'):
+            metrics_check = tk.Checkbutton(
+                filter_frame,
+                text="TCP metrics",
+                variable=self.collect_tcp_metrics,
+                fg='white',
+                bg='black',
+                selectcolor='black',
+                activebackground='black',
+                activeforeground='white'
+            )
+            metrics_check.pack(side=tk.LEFT, padx=5)
+        
+        top_remotes_button = tk.Button(
+            filter_frame,
+            text="Top Remotes",
+            fg='black',
+            bg='white',
+            relief=tk.RIDGE,
+            command=self.show_top_remotes
+        )
+        top_remotes_button.pack(side=tk.RIGHT, padx=5)
+        
         # Log area
         self.log_area = scrolledtext.ScrolledText(
             log_frame,
@@ -223,6 +422,14 @@ class MonitorWindow:
         self.backup_interval = 5  # seconds
         self.last_backup = time.time()
         self.backup_count = 0
+        self.analytics_interval = 2  # seconds between distinct-remote estimates
+        self.last_analytics = 0
+        self.top_remotes_window = None
+        self.backup_manager = None  # compresses and rotates final backups
+        self.metrics_collector = None
+        self.capture_filter = None
+        self.checkpoints = None  # periodic tracker checkpoints
+        self.resume_checkpoint = True  # the first run after launch resumes the last checkpoint
 
     def log_message(self, message, protocol=''):
         """Log a message if its protocol type is enabled in filters"""
@@ -246,25 +453,98 @@ class MonitorWindow:
             self.total_status_label.config(
                 text=f"Total Connections: {self.tracker.total_tracked}"
             )
+            skipped = self.tracker.ticks_skipped
+            self.skipped_label.config(
+                text=f"Unchanged samples skipped: {skipped} of {skipped + self.tracker.ticks_processed}"
+            )
+            
+            now = time.time()
+            rollups = self.tracker.rollups
+            self.tcp_sparkline.set_values(rollups.series('second', 'TCP', 'new', now))
+            self.udp_sparkline.set_values(rollups.series('second', 'UDP', 'new', now))
+            
+            # Merging the sliding HyperLogLog buckets is too costly for every tick
+            if now - self.last_analytics >= self.analytics_interval:
+                self.last_analytics = now
+                hll = self.tracker.analytics.distinct_remotes
+                self.remotes_label.config(
+                    text=f"Distinct remote IPs - last 5 min: {hll.distinct(300, now)}, "
+                         f"last hour: {hll.distinct(3600, now)}"
+                )
+
+    def show_top_remotes(self):
+        """Open (or raise) a window listing the heaviest remote IPs and ports"""
+        if self.top_remotes_window is not None and self.top_remotes_window.winfo_exists():
+            self.top_remotes_window.lift()
+            return
+        
+        self.top_remotes_window = tk.Toplevel(self.window)
+        self.top_remotes_window.title("NetConMon - Top Remote Endpoints")
+        self.top_remotes_window.geometry("600x700")
+        
+        report_area = scrolledtext.ScrolledText(
+            self.top_remotes_window,
+            font=("Courier", 10),
+            bg='#1a1a1a',
+            fg='#00ff00'
+        )
+        report_area.pack(fill=tk.BOTH, expand=True)
+        self.refresh_top_remotes(report_area)
+
+    def refresh_top_remotes(self, report_area):
+        """Redraw the top remotes report every few seconds while its window is open"""
+        if not report_area.winfo_exists():
+            return
+        report_area.delete(1.0, tk.END)
+        if self.tracker:
+            lines = self.tracker.analytics.report(time.time())
+        else:
+            lines = ["Start monitoring to collect remote endpoint statistics."]
+        report_area.insert(tk.END, "\n".join(lines))
+        report_area.after(self.analytics_interval * 1000, self.refresh_top_remotes, report_area)
 
     def start_monitoring(self):
+        from capturefilter import compile_filter
+
+        self.capture_filter = None
+        expression = self.capture_filter_text.get().strip()
+        if expression:
+            try:
+                self.capture_filter = compile_filter(expression)
+            except ValueError as e:
+                messagebox.showerror("Invalid capture filter", str(e))
+                return
+        
         self.is_monitoring = True
+        self.capture_filter_entry.config(state=tk.DISABLED)
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
         self.export_button.config(state=tk.DISABLED)
         self.log_area.delete(1.0, tk.END)
         self.log_message("Starting network monitoring...")
+        if self.capture_filter:
+            self.log_message(f"Capture filter: {self.capture_filter.expression}")
         
         self.monitor_thread = threading.Thread(target=self.monitor_connections)
         self.monitor_thread.daemon = True
         self.monitor_thread.start()
 
     def monitor_connections(self):
-        self.tracker = networkmonitor.ConnectionTracker()
+        import networkmonitor
+
+        self.tracker = self.create_tracker()
+        self.metrics_collector = None
+        if self.collect_tcp_metrics.get():
+            if networkmonitor.TcpMetricsCollector.available():
+                self.metrics_collector = networkmonitor.TcpMetricsCollector()
+            else:
+                self.window.after(0, self.log_message, "TCP metrics are not available on this system")
         while self.is_monitoring:
             try:
-                current_connections = networkmonitor.get_current_connections()
-                new_connections = self.tracker.update(current_connections)
+                current_connections, fingerprint = networkmonitor.get_connection_snapshot(self.capture_filter)
+                new_connections = self.tracker.update(current_connections, fingerprint)
+                if self.metrics_collector:
+                    self.metrics_collector.refresh(self.tracker, new_connections)
                 
                 # Update status for both TCP and UDP connections
                 self.window.after(0, self.update_status)
@@ -277,14 +557,72 @@ class MonitorWindow:
                 
                 # Perform auto-backup
                 self.auto_backup()
+                if self.checkpoints and self.checkpoints.due():
+                    self.checkpoints.save(self.tracker, background=True)
                 
                 threading.Event().wait(0.1)
             except Exception as e:
                 self.window.after(0, self.log_message, f"Error: {str(e)}")
                 break
+        # Lets the next start resume from where this run stopped
+        if self.checkpoints:
+            self.checkpoints.save(self.tracker)
+        # Kept (closed) so exports still know metrics were collected
+        self.close_metrics_collector()
+
+    def create_tracker(self):
+        """Start a fresh tracker, stopping the worker processes of a previous sharded one"""
+        import networkmonitor
+        from checkpoint import CheckpointManager
+
+        self.close_tracker()
+        self.checkpoints = None
+        resume, self.resume_checkpoint = self.resume_checkpoint, False
+        if self.shards:
+            try:
+                from shardedtracker import ShardedConnectionTracker
+                tracker = ShardedConnectionTracker(self.shards)
+            except (ImportError, OSError, ValueError) as e:
+                self.window.after(0, self.log_message, f"Sharded tracking is not available ({e}); using one process")
+            else:
+                # Saving would rotate out the checkpoints of the runs this one did not resume
+                self.window.after(0, self.log_message,
+                                  "Checkpoints need the default tracker; this run neither resumes from nor saves them")
+                return tracker
+        self.checkpoints = CheckpointManager(
+            networkmonitor.get_local_backup_directory(),
+            report=lambda message: self.window.after(0, self.log_message, message))
+        tracker = networkmonitor.ConnectionTracker()
+        if resume:
+            self.resume_tracker(tracker)
+        return tracker
+
+    def resume_tracker(self, tracker):
+        """Continue from the latest valid checkpoint, if there is one"""
+        from checkpoint import resume_tracker
+
+        load_start = time.perf_counter()
+        checkpoint = self.checkpoints.latest()
+        if checkpoint:
+            resume_tracker(tracker, checkpoint)
+            saved_at = datetime.fromtimestamp(checkpoint.saved_at).strftime('%Y-%m-%d %H:%M:%S')
+            self.window.after(0, self.log_message,
+                              f"Resumed {len(checkpoint)} connections from the checkpoint of {saved_at} "
+                              f"in {(time.perf_counter() - load_start) * 1000:.0f} ms")
+
+    def close_metrics_collector(self):
+        if self.metrics_collector is not None:
+            self.metrics_collector.close()
+
+    def close_tracker(self):
+        close = getattr(self.tracker, 'close', None)
+        if close is not None:
+            close()
 
     def auto_backup(self):
         """Perform automatic backup of current data"""
+        import networkmonitor
+
         if self.tracker and self.is_monitoring:
             try:
                 current_time = time.time()
@@ -313,14 +651,38 @@ class MonitorWindow:
 
     def stop_monitoring(self):
         self.is_monitoring = False
-        self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
-        self.export_button.config(state=tk.NORMAL)
         self.log_message("\nStopping network monitoring...")
+        # The export syncs the tracker, which only the monitor thread may do while it runs
+        self.wait_for_monitor_thread()
+        self.start_button.config(state=tk.NORMAL)
+        self.export_button.config(state=tk.NORMAL)
+        self.capture_filter_entry.config(state=tk.NORMAL)
         self.save_final_backup()
 
+    def wait_for_monitor_thread(self):
+        """Let the monitor thread finish, handling the UI calls it makes meanwhile"""
+        while self.monitor_thread is not None and self.monitor_thread.is_alive():
+            self.window.update()
+            self.monitor_thread.join(0.05)
+
+    def close(self):
+        """Stop monitoring before the window goes away"""
+        if self.is_monitoring:
+            self.stop_monitoring()
+        # The monitor thread saves a last checkpoint from the tracker before it ends
+        self.wait_for_monitor_thread()
+        self.close_metrics_collector()
+        self.close_tracker()
+        if self.backup_manager is not None:
+            # Compressions already queued still finish in the background
+            self.backup_manager.shutdown(wait=False)
+        self.window.destroy()
+
     def save_final_backup(self):
         """Save final backup to the backup directory"""
+        import networkmonitor
+
         if self.tracker:
             try:
                 backup_dir = networkmonitor.get_local_backup_directory()
@@ -336,11 +698,19 @@ class MonitorWindow:
                 self.log_message(f"CSV: {csv_filename.name}")
                 self.log_message(f"TXT: {txt_filename.name}")
                 
+                # Compress and rotate finished backups off the monitoring path
+                if self.backup_manager is None:
+                    from backups import BackupManager
+                    self.backup_manager = BackupManager(backup_dir)
+                self.backup_manager.rotate()
+                
             except Exception as e:
                 self.log_message(f"Error saving final backup: {str(e)}")
 
     def export_results(self):
         """Export results to user-selected directory"""
+        import networkmonitor
+
         if not self.tracker:
             messagebox.showerror("Error", "No monitoring data available to export!")
             return
@@ -358,8 +728,10 @@ class MonitorWindow:
                 csv_filename = export_dir / f'network_connections_{timestamp}.csv'
                 txt_filename = export_dir / f'network_connections_{timestamp}.txt'
                 
-                networkmonitor.write_to_csv(self.tracker, csv_filename)
-                networkmonitor.write_to_txt(self.tracker, txt_filename)
+                networkmonitor.write_to_csv(self.tracker, csv_filename,
+                                            include_tcp_metrics=self.metrics_collector is not None)
+                networkmonitor.write_to_txt(self.tracker, txt_filename, include_rollups=True,
+                                            include_analytics=True, include_state_metrics=True)
                 
                 self.log_message(f"\nResults exported to:")
                 self.log_message(f"CSV: {csv_filename}")
@@ -377,8 +749,10 @@ class MonitorWindow:
             )
 
 class MainWindow:
-    def __init__(self):
+    def __init__(self, shards=None):
         self.window = tk.Tk()
+        self.monitor_window = None
+        self.shards = shards
         self.window.title("NetConMon")
         
         # Window sizing
@@ -435,8 +809,12 @@ class MainWindow:
         self.doc_button.pack()
 
     def run_monitor(self):
-        monitor_window = MonitorWindow()
-        monitor_window.window.mainloop()
+        # Only one monitor at a time; it shares this window's Tk root
+        if self.monitor_window is not None and self.monitor_window.window.winfo_exists():
+            self.monitor_window.window.deiconify()
+            self.monitor_window.window.lift()
+            return
+        self.monitor_window = MonitorWindow(self.window, self.shards)
 
     def open_documentation(self):
         doc_path = Path("readme.txt")
@@ -449,17 +827,42 @@ class MainWindow:
         else:
             messagebox.showerror("Error", "Documentation file (readme.txt) not found!")
 
-def main():
+def check_privileges(window):
+    """Exit with an error dialog if network information is not accessible"""
+    import networkmonitor
+
     if not networkmonitor.check_privileges():
         messagebox.showerror(
             "Error",
             "Please run with administrator privileges:\n\n" +
             "Windows: Right-click, Run as Administrator\n" +
-            "Mac/Linux: Use sudo python3 netconmon.py"
+            "Mac/Linux: Use sudo python3 netconmon.py",
+            parent=window
         )
+        window.destroy()
         sys.exit(1)
+
+def report_startup_time(window):
+    """Print the time from process start until the main window is drawn, then exit"""
+    window.update()
+    elapsed = (time.perf_counter() - _STARTUP_BEGIN) * 1000
+    print(f"Startup time: {elapsed:.1f}ms")
+    window.destroy()
+
+def main():
+    parser = argparse.ArgumentParser(description="NetConMon - Network Connection Monitor")
+    parser.add_argument('--startup-time', action='store_true',
+                        help="measure how long the main window takes to appear, then exit")
+    parser.add_argument('--shards', type=int, metavar='N',
+                        help="spread connection tracking over N worker processes (for hosts with very many sockets)")
+    args = parser.parse_args()
     
-    main_window = MainWindow()
+    main_window = MainWindow(args.shards)
+    if args.startup_time:
+        main_window.window.after_idle(report_startup_time, main_window.window)
+    else:
+        # Checked once the window is up so psutil is not on the startup path
+        main_window.window.after_idle(check_privileges, main_window.window)
     main_window.window.mainloop()
 
 if __name__ == "__main__":
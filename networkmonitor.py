@@ -3,17 +3,46 @@ import csv
 import time
 import platform
 import sys
+import argparse
 from datetime import datetime
 from pathlib import Path
-from collections import defaultdict
+from collections import Counter, defaultdict
+from rollups import ConnectionRollups, write_rollup_summary
+from sketches import RemoteEndpointAnalytics
+from statehistory import StateHistory, write_state_metrics
+from backups import list_backups, resolve_backup, read_backup_csv
+from tcpmetrics import METRIC_COLUMNS, TcpMetricsCollector
+from capturefilter import compile_filter
+
+def new_connection_record():
+    """An empty connection record; first_seen stays None until the connection is seen"""
+    return {'count': 0, 'first_seen': None, 'last_seen': None, 'info': None,
+            'status': None, 'history': None, 'metrics': None}
 
 class ConnectionTracker:
     def __init__(self):
         # Separate tracking for TCP and UDP connections
-        self.tcp_connections = defaultdict(lambda: {'count': 0, 'first_seen': None, 'last_seen': None, 'info': None})
-        self.udp_connections = defaultdict(lambda: {'count': 0, 'first_seen': None, 'last_seen': None, 'info': None})
+        self.tcp_connections = defaultdict(new_connection_record)
+        self.udp_connections = defaultdict(new_connection_record)
         self.total_tcp_tracked = 0
         self.total_udp_tracked = 0
+        # Keys present in the previous snapshot, used to count closed connections
+        self.live_keys = {'TCP': set(), 'UDP': set()}
+        # Keys that appeared more than once in the previous snapshot -> extra occurrences
+        self.live_repeats = {'TCP': {}, 'UDP': {}}
+        self.live_remotes = {'TCP': set(), 'UDP': set()}
+        self.all_live_remotes = set()
+        self.rollups = ConnectionRollups()
+        self.analytics = RemoteEndpointAnalytics()
+        # Unchanged-snapshot skipping: repeats of the last processed snapshot
+        # are counted here and applied to the records by sync()
+        self.last_fingerprint = None
+        self.pending_repeats = 0
+        self.pending_time = None
+        self.ticks_processed = 0
+        self.ticks_skipped = 0
+        # Connections whose status changed in the last update (for tcp_info refreshes)
+        self.status_changes = []
     
     @property
     def total_tracked(self):
@@ -34,24 +63,50 @@ class ConnectionTracker:
         key2 = f"{protocol}-{remote_ip}:{remote_port}-{local_ip}:{local_port}"
         return min(key1, key2)
 
-    def update(self, new_connections):
+    def update(self, new_connections, fingerprint=None):
         """
         Update the connection history with new connections.
         Returns newly discovered connections for both TCP and UDP.
+        
+        If a fingerprint (see snapshot_fingerprint) is given and matches the
+        last processed snapshot, the per-connection work is skipped; the
+        result is the same as processing the snapshot in full.
         """
         current_time = datetime.now()
+        if fingerprint is not None and fingerprint == self.last_fingerprint:
+            self.repeat_last_snapshot(current_time)
+            return []
+        
+        self.sync()
+        self.ticks_processed += 1
+        self.status_changes = []
         newly_discovered = []
+        live_keys = {'TCP': set(), 'UDP': set()}
+        live_repeats = {'TCP': {}, 'UDP': {}}
+        remotes = {'TCP': set(), 'UDP': set()}
+        tracked_before = {'TCP': self.total_tcp_tracked, 'UDP': self.total_udp_tracked}
 
         for conn_info in new_connections:
             protocol = conn_info[5]  # Get protocol from the extended connection info
             connections_dict = self.tcp_connections if protocol == 'TCP' else self.udp_connections
             
             key = self.get_connection_key(conn_info)
-            if connections_dict[key]['first_seen'] is None:
+            conn_data = connections_dict[key]
+            repeated = key in live_keys[protocol]
+            if repeated:
+                # Both ends of a local connection, or sockets sharing a UDP bind
+                repeats = live_repeats[protocol]
+                repeats[key] = repeats.get(key, 0) + 1
+            else:
+                live_keys[protocol].add(key)
+            if conn_info[2]:
+                remotes[protocol].add(conn_info[2])
+            if conn_data['first_seen'] is None:
                 # This is a new connection we haven't seen before
-                connections_dict[key].update({
+                conn_data.update({
                     'first_seen': current_time,
                     'info': conn_info,
+                    'status': conn_info[4],
                     'count': 1
                 })
                 newly_discovered.append(conn_info)
@@ -61,13 +116,91 @@ class ConnectionTracker:
                     self.total_udp_tracked += 1
             else:
                 # We've seen this connection before
-                connections_dict[key]['count'] += 1
+                conn_data['count'] += 1
+                # Both ends of a local connection share one record and may differ
+                # in status (FIN_WAIT2/CLOSE_WAIT); only the first occurrence of the
+                # recorded side changes it, so a repeated snapshot never does
+                if conn_info[4] != conn_data['status'] and not repeated \
+                        and conn_info[:2] == conn_data['info'][:2]:
+                    self.record_transition(conn_data, conn_info[4], current_time)
+                    self.status_changes.append(conn_info)
             
             # Update last seen time
-            connections_dict[key]['last_seen'] = current_time
+            conn_data['last_seen'] = current_time
 
+        self.record_rollups(current_time, live_keys, remotes, tracked_before)
+        self.live_repeats = live_repeats
+        self.live_remotes = remotes
+        self.all_live_remotes = remotes['TCP'] | remotes['UDP']
+        self.analytics.update(current_time.timestamp(), newly_discovered, self.all_live_remotes)
+        self.last_fingerprint = fingerprint
         return newly_discovered
 
+    def repeat_last_snapshot(self, current_time):
+        """Account for a snapshot identical to the last processed one"""
+        self.ticks_skipped += 1
+        self.pending_repeats += 1
+        self.status_changes = []
+        self.pending_time = current_time
+        
+        timestamp = current_time.timestamp()
+        for protocol, keys in self.live_keys.items():
+            self.rollups.record(timestamp, protocol, 0, 0, self.live_remotes[protocol], len(keys))
+        self.analytics.update(timestamp, (), self.all_live_remotes)
+
+    def sync(self):
+        """
+        Apply skipped repeats to the connection records. Must be called before
+        reading tcp_connections/udp_connections directly, and not while
+        another thread is in update().
+        """
+        if not self.pending_repeats:
+            return
+        for protocol, connections in (('TCP', self.tcp_connections), ('UDP', self.udp_connections)):
+            for key in self.live_keys[protocol]:
+                conn_data = connections[key]
+                conn_data['count'] += self.pending_repeats
+                conn_data['last_seen'] = self.pending_time
+            for key, extra in self.live_repeats[protocol].items():
+                connections[key]['count'] += extra * self.pending_repeats
+        self.pending_repeats = 0
+
+    def record_transition(self, conn_data, status, current_time):
+        """Record a status change; the history is only allocated on the first change"""
+        if conn_data['history'] is None:
+            conn_data['history'] = StateHistory(conn_data['status'], conn_data['first_seen'].timestamp())
+        conn_data['history'].record(status, current_time.timestamp())
+        conn_data['status'] = status
+
+    def record_tcp_metrics(self, samples):
+        """
+        Store tcp_info samples on the matching TCP connections.
+        
+        Args:
+            samples: (connection info tuple, TcpMetrics) pairs; samples for
+                connections that are not tracked are ignored
+        """
+        for conn_info, metrics in samples:
+            conn_data = self.tcp_connections.get(self.get_connection_key(conn_info))
+            if conn_data is None or conn_data['first_seen'] is None:
+                continue
+            # Both ends of a local connection share one record; follow the recorded side
+            if conn_info[:2] != conn_data['info'][:2]:
+                continue
+            metrics.add_deltas(conn_data['metrics'])
+            conn_data['metrics'] = metrics
+
+    def record_rollups(self, current_time, live_keys, remotes, tracked_before):
+        """Feed the time-windowed rollups with the result of one update"""
+        timestamp = current_time.timestamp()
+        tracked_after = {'TCP': self.total_tcp_tracked, 'UDP': self.total_udp_tracked}
+        for protocol, keys in live_keys.items():
+            closed = len(self.live_keys[protocol] - keys)
+            self.rollups.record(timestamp, protocol,
+                                tracked_after[protocol] - tracked_before[protocol],
+                                closed, remotes[protocol], len(keys))
+        self.live_keys = live_keys
+
 def check_privileges():
     """
     Check if the script has the necessary privileges to access network information.
@@ -78,51 +211,83 @@ def check_privileges():
     except psutil.AccessDenied:
         return False
 
-def get_current_connections():
+def get_current_connections(capture_filter=None):
     """
     Get current network connections including both TCP and UDP.
+    Args:
+        capture_filter: Optional CaptureFilter; only matching sockets are returned
     Returns a list of tuples containing connection information.
     """
     connections = []
+    kinds = capture_filter.kinds if capture_filter else {'TCP': 'tcp', 'UDP': 'udp'}
+    matches = capture_filter.matches if capture_filter else None
     try:
         # Get TCP connections
-        for conn in psutil.net_connections(kind='inet'):
-            try:
-                if conn.raddr:  # Only include connections with remote address for TCP
+        if 'TCP' in kinds:
+            for conn in psutil.net_connections(kind=kinds['TCP']):
+                try:
+                    if conn.raddr:  # Only include connections with remote address for TCP
+                        local_ip = conn.laddr.ip
+                        local_port = conn.laddr.port
+                        remote_ip = conn.raddr.ip
+                        remote_port = conn.raddr.port
+                        status = conn.status
+                        protocol = 'TCP'
+
+                        if matches and not matches(protocol, local_ip, local_port, remote_ip, remote_port, status):
+                            continue
+                        connections.append((local_ip, local_port, remote_ip, remote_port, status, protocol))
+                except (IndexError, AttributeError):
+                    continue
+
+        # Get UDP connections
+        if 'UDP' in kinds:
+            for conn in psutil.net_connections(kind=kinds['UDP']):
+                try:
                     local_ip = conn.laddr.ip
                     local_port = conn.laddr.port
-                    remote_ip = conn.raddr.ip
-                    remote_port = conn.raddr.port
+
+                    # Handle case where there might not be a remote address (common in UDP)
+                    remote_ip = conn.raddr.ip if conn.raddr else ''
+                    remote_port = conn.raddr.port if conn.raddr else 0
+
                     status = conn.status
-                    protocol = 'TCP'
-                    
+                    protocol = 'UDP'
+
+                    if matches and not matches(protocol, local_ip, local_port, remote_ip, remote_port, status):
+                        continue
                     connections.append((local_ip, local_port, remote_ip, remote_port, status, protocol))
-            except (IndexError, AttributeError):
-                continue
+                except (IndexError, AttributeError):
+                    continue
 
-        # Get UDP connections
-        for conn in psutil.net_connections(kind='udp'):
-            try:
-                local_ip = conn.laddr.ip
-                local_port = conn.laddr.port
-                
-                # Handle case where there might not be a remote address (common in UDP)
-                remote_ip = conn.raddr.ip if conn.raddr else ''
-                remote_port = conn.raddr.port if conn.raddr else 0
-                
-                status = conn.status
-                protocol = 'UDP'
-                
-                connections.append((local_ip, local_port, remote_ip, remote_port, status, protocol))
-            except (IndexError, AttributeError):
-                continue
-                
     except psutil.AccessDenied:
         print("Access denied. Try running with administrator/root privileges.")
         sys.exit(1)
     
     return connections
 
+def snapshot_fingerprint(connections):
+    """
+    Cheap, order-independent fingerprint of a connection snapshot.
+    Equal snapshots always have equal fingerprints.
+    """
+    distinct = frozenset(connections)
+    if len(distinct) == len(connections):
+        return len(connections), hash(distinct)
+    # Repeated sockets: count them, so [a, a, b] and [a, b, b] differ
+    return len(connections), hash(frozenset(Counter(connections).items()))
+
+def get_connection_snapshot(capture_filter=None):
+    """
+    Get the current connections together with their fingerprint.
+    Args:
+        capture_filter: Optional CaptureFilter applied before tracking
+    Returns:
+        tuple: (list of connection tuples, fingerprint)
+    """
+    connections = get_current_connections(capture_filter)
+    return connections, snapshot_fingerprint(connections)
+
 def get_local_backup_directory():
     """
     Create and return path to local backup directory in the same folder as the script.
@@ -152,7 +317,7 @@ def get_output_directory():
     else:  # macOS and Linux
         return Path.home()
 
-def write_to_csv(tracker, filename, create_parent=True):
+def write_to_csv(tracker, filename, create_parent=True, include_tcp_metrics=False):
     """
     Write connection history to a CSV file.
     
@@ -160,7 +325,9 @@ def write_to_csv(tracker, filename, create_parent=True):
         tracker: ConnectionTracker instance
         filename: Path to save the CSV file
         create_parent: If True, create parent directories if they don't exist
+        include_tcp_metrics: If True, add the latest tcp_info metrics and throughput columns
     """
+    tracker.sync()
     path = Path(filename)
     if create_parent:
         path.parent.mkdir(parents=True, exist_ok=True)
@@ -168,30 +335,39 @@ def write_to_csv(tracker, filename, create_parent=True):
     try:
         with path.open('w', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(['Protocol', 'Local IP', 'Local Port', 'Remote IP', 'Remote Port', 'Status', 
-                           'First Seen', 'Last Seen', 'Connection Count'])
+            header = ['Protocol', 'Local IP', 'Local Port', 'Remote IP', 'Remote Port', 'Status', 
+                      'First Seen', 'Last Seen', 'Connection Count']
+            no_metrics = []
+            if include_tcp_metrics:
+                header += METRIC_COLUMNS
+                no_metrics = [''] * len(METRIC_COLUMNS)
+            writer.writerow(header)
             
             # Write TCP connections
             for conn_data in tracker.tcp_connections.values():
                 if conn_data['first_seen']:
                     info = conn_data['info']
-                    writer.writerow([
-                        'TCP', info[0], info[1], info[2], info[3], info[4],
+                    row = [
+                        'TCP', info[0], info[1], info[2], info[3], conn_data['status'],
                         conn_data['first_seen'].strftime('%Y-%m-%d %H:%M:%S'),
                         conn_data['last_seen'].strftime('%Y-%m-%d %H:%M:%S'),
                         conn_data['count']
-                    ])
+                    ]
+                    if include_tcp_metrics:
+                        metrics = conn_data['metrics']
+                        row += metrics.columns() if metrics else no_metrics
+                    writer.writerow(row)
             
             # Write UDP connections
             for conn_data in tracker.udp_connections.values():
                 if conn_data['first_seen']:
                     info = conn_data['info']
                     writer.writerow([
-                        'UDP', info[0], info[1], info[2], info[3], info[4],
+                        'UDP', info[0], info[1], info[2], info[3], conn_data['status'],
                         conn_data['first_seen'].strftime('%Y-%m-%d %H:%M:%S'),
                         conn_data['last_seen'].strftime('%Y-%m-%d %H:%M:%S'),
                         conn_data['count']
-                    ])
+                    ] + no_metrics)
     except PermissionError:
         print(f"Error: Cannot write to {filename}. Permission denied.")
         return False
@@ -200,7 +376,8 @@ def write_to_csv(tracker, filename, create_parent=True):
         return False
     return True
 
-def write_to_txt(tracker, filename, create_parent=True):
+def write_to_txt(tracker, filename, create_parent=True, include_rollups=False,
+                 include_analytics=False, include_state_metrics=False):
     """
     Write connection history to a text file.
     
@@ -208,7 +385,11 @@ def write_to_txt(tracker, filename, create_parent=True):
         tracker: ConnectionTracker instance
         filename: Path to save the text file
         create_parent: If True, create parent directories if they don't exist
+        include_rollups: If True, append the per-second/minute/hour rollup summary
+        include_analytics: If True, append top remote endpoints and distinct remote counts
+        include_state_metrics: If True, append aggregate time-in-state metrics
     """
+    tracker.sync()
     path = Path(filename)
     if create_parent:
         path.parent.mkdir(parents=True, exist_ok=True)
@@ -226,10 +407,12 @@ def write_to_txt(tracker, filename, create_parent=True):
             for conn_data in tracker.tcp_connections.values():
                 if conn_data['first_seen']:
                     info = conn_data['info']
-                    txtfile.write(f"Local: {info[0]}:{info[1]} → Remote: {info[2]}:{info[3]} ({info[4]})\n")
+                    txtfile.write(f"Local: {info[0]}:{info[1]} → Remote: {info[2]}:{info[3]} ({conn_data['status']})\n")
                     txtfile.write(f"  First seen: {conn_data['first_seen'].strftime('%Y-%m-%d %H:%M:%S')}\n")
                     txtfile.write(f"  Last seen: {conn_data['last_seen'].strftime('%Y-%m-%d %H:%M:%S')}\n")
                     txtfile.write(f"  Connection count: {conn_data['count']}\n")
+                    if conn_data['metrics']:
+                        txtfile.write(f"  TCP metrics: {conn_data['metrics'].describe()}\n")
                     txtfile.write("-" * 40 + "\n")
             
             # Write UDP connections
@@ -239,11 +422,23 @@ def write_to_txt(tracker, filename, create_parent=True):
                 if conn_data['first_seen']:
                     info = conn_data['info']
                     remote_info = f"Remote: {info[2]}:{info[3]}" if info[2] else "No remote endpoint"
-                    txtfile.write(f"Local: {info[0]}:{info[1]} → {remote_info} ({info[4]})\n")
+                    txtfile.write(f"Local: {info[0]}:{info[1]} → {remote_info} ({conn_data['status']})\n")
                     txtfile.write(f"  First seen: {conn_data['first_seen'].strftime('%Y-%m-%d %H:%M:%S')}\n")
                     txtfile.write(f"  Last seen: {conn_data['last_seen'].strftime('%Y-%m-%d %H:%M:%S')}\n")
                     txtfile.write(f"  Connection count: {conn_data['count']}\n")
                     txtfile.write("-" * 40 + "\n")
+            
+            if include_rollups:
+                write_rollup_summary(tracker.rollups, txtfile)
+            
+            if include_analytics:
+                txtfile.write("\nRemote Endpoint Analytics:\n")
+                txtfile.write("=" * 40 + "\n")
+                for line in tracker.analytics.report(datetime.now().timestamp()):
+                    txtfile.write(line + "\n")
+            
+            if include_state_metrics:
+                write_state_metrics(tracker, txtfile)
     except PermissionError:
         print(f"Error: Cannot write to {filename}. Permission denied.")
         return False
@@ -252,7 +447,58 @@ def write_to_txt(tracker, filename, create_parent=True):
         return False
     return True
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Network Connection Monitor")
+    parser.add_argument('--top', type=int, default=20, metavar='N',
+                        help="number of top remote IPs/ports to report (default: 20)")
+    parser.add_argument('--analytics', action='store_true',
+                        help="print top remote endpoints and distinct remote counts with each stats update")
+    trackers = parser.add_mutually_exclusive_group()
+    trackers.add_argument('--batch', action='store_true',
+                          help="use the NumPy batch tracker (faster with very many sockets; requires numpy)")
+    trackers.add_argument('--shards', type=int, metavar='N',
+                          help="spread connection tracking over N worker processes (for hosts with very many sockets)")
+    parser.add_argument('--tcp-metrics', action='store_true',
+                        help="collect RTT, bytes, retransmits and cwnd of TCP connections (Linux only)")
+    parser.add_argument('--tcp-metrics-interval', type=float, default=5.0, metavar='SECONDS',
+                        help="seconds between full TCP metrics refreshes (default: 5)")
+    parser.add_argument('--filter', metavar='EXPR',
+                        help="only track sockets matching a capture filter, e.g. "
+                             "'not loopback and not (udp and remote port 53)'")
+    parser.add_argument('--checkpoint-interval', type=float, default=300, metavar='SECONDS',
+                        help="seconds between tracker checkpoints used to resume after a restart "
+                             "(default: 300; 0 disables periodic checkpoints)")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="start with an empty tracker instead of resuming from the latest checkpoint")
+    parser.add_argument('--list-backups', action='store_true',
+                        help="list the backups (compressed or not) and exit")
+    parser.add_argument('--read-backup', metavar='NAME',
+                        help="print a CSV backup by name, decompressing it if needed, and exit")
+    return parser.parse_args()
+
+def show_backups(args):
+    """Handle the backup query options. Returns True if one was given."""
+    backup_dir = get_local_backup_directory()
+    if args.list_backups:
+        for name, size, compressed in list_backups(backup_dir):
+            print(f"{name:<60} {size:>12} bytes{'  (compressed)' if compressed else ''}")
+        return True
+    if args.read_backup:
+        try:
+            writer = csv.writer(sys.stdout)
+            for row in read_backup_csv(resolve_backup(backup_dir, args.read_backup)):
+                writer.writerow(row)
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        return True
+    return False
+
 def main():
+    args = parse_args()
+    if show_backups(args):
+        return
+    
     if not check_privileges():
         if platform.system().lower() == 'windows':
             print("Please run this script as Administrator (right-click, Run as Administrator)")
@@ -264,11 +510,61 @@ def main():
     SAMPLE_INTERVAL = 0.1  # seconds between checks
     STATS_INTERVAL = 5.0   # seconds between performance stats updates
 
+    capture_filter = None
+    if args.filter:
+        try:
+            capture_filter = compile_filter(args.filter)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    metrics_collector = None
+    if args.tcp_metrics:
+        if TcpMetricsCollector.available():
+            metrics_collector = TcpMetricsCollector(args.tcp_metrics_interval)
+        else:
+            print("TCP metrics need Linux sock_diag support; continuing without them.")
+    
     print(f"Network Connection Monitor Starting on {platform.system()}...")
     print(f"Sampling every {SAMPLE_INTERVAL} seconds...")
+    if capture_filter:
+        print(f"Capture filter: {capture_filter.expression}")
     print("Monitoring for new connections... Press Ctrl+C to stop and save results.")
     
-    tracker = ConnectionTracker()
+    if args.batch:
+        try:
+            from batchtracker import BatchConnectionTracker
+        except ImportError:
+            print("The --batch option requires NumPy (pip install numpy)")
+            sys.exit(1)
+        tracker = BatchConnectionTracker()
+    elif args.shards:
+        try:
+            from shardedtracker import ShardedConnectionTracker
+            tracker = ShardedConnectionTracker(args.shards)
+        except (ImportError, ValueError) as e:
+            print(f"Cannot start sharded tracking: {e}")
+            sys.exit(1)
+    else:
+        tracker = ConnectionTracker()
+    
+    from checkpoint import CheckpointManager, resume_tracker
+    checkpoints = None
+    if args.batch or args.shards:
+        # Saving would rotate out the checkpoints of the runs this one did not resume
+        print("Checkpoints need the default tracker; this run neither resumes from nor saves them.")
+    else:
+        # The stats line is rewritten in place, so save reports start on a line of their own
+        checkpoints = CheckpointManager(get_local_backup_directory(), args.checkpoint_interval,
+                                        report=lambda message: print(f"\n{message}"))
+        if not args.no_resume and checkpoints.checkpoint_files():
+            load_start = time.perf_counter()
+            checkpoint = checkpoints.latest()
+            if checkpoint:
+                resume_tracker(tracker, checkpoint)
+                saved_at = datetime.fromtimestamp(checkpoint.saved_at).strftime('%Y-%m-%d %H:%M:%S')
+                print(f"Resumed {len(checkpoint)} connections from the checkpoint of {saved_at} "
+                      f"in {(time.perf_counter() - load_start) * 1000:.0f} ms")
     
     # Performance monitoring variables
     last_stats_time = time.time()
@@ -279,8 +575,12 @@ def main():
         while True:
             sample_start = time.time()
             
-            current_connections = get_current_connections()
-            new_connections = tracker.update(current_connections)
+            current_connections, fingerprint = get_connection_snapshot(capture_filter)
+            new_connections = tracker.update(current_connections, fingerprint)
+            if metrics_collector:
+                metrics_collector.refresh(tracker, new_connections)
+            if checkpoints and checkpoints.due():
+                checkpoints.save(tracker, background=True)
             
             # Print information about new connections
             for conn in new_connections:
@@ -306,6 +606,11 @@ def main():
                 print(f"\nPerformance Stats:")
                 print(f"  Average sample time: {avg_sample_time:.2f}ms")
                 print(f"  CPU usage: {cpu_percent}%")
+                print(f"  Unchanged samples skipped: {tracker.ticks_skipped} "
+                      f"of {tracker.ticks_skipped + tracker.ticks_processed}")
+                if args.analytics:
+                    for line in tracker.analytics.report(sample_end, args.top):
+                        print(f"  {line}")
                 
                 # Reset stats
                 last_stats_time = sample_end
@@ -325,8 +630,9 @@ def main():
         csv_filename = output_dir / f'network_connections_{timestamp}.csv'
         txt_filename = output_dir / f'network_connections_{timestamp}.txt'
         
-        csv_success = write_to_csv(tracker, csv_filename)
-        txt_success = write_to_txt(tracker, txt_filename)
+        csv_success = write_to_csv(tracker, csv_filename, include_tcp_metrics=metrics_collector is not None)
+        txt_success = write_to_txt(tracker, txt_filename, include_rollups=True,
+                                   include_analytics=True, include_state_metrics=True)
         
         if csv_success and txt_success:
             print(f"Results saved to:")
@@ -334,6 +640,14 @@ def main():
             print(f"TXT: {txt_filename}")
         else:
             print("There were some errors saving the files. Please check the error messages above.")
+        
+        if checkpoints and checkpoints.save(tracker):
+            print("Tracker checkpoint saved; the next start resumes from it.")
+        
+        if metrics_collector:
+            metrics_collector.close()
+        if args.shards:
+            tracker.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
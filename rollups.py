@@ -0,0 +1,189 @@
+from array import array
+from datetime import datetime
+
+from sketches import HyperLogLog, hash64
+
+PROTOCOLS = ('TCP', 'UDP')
+METRICS = ('new', 'closed', 'remotes', 'live')
+METRIC_NAMES = {
+    'new': 'New connections',
+    'closed': 'Closed connections',
+    'remotes': 'Distinct remotes',
+    'live': 'Live sockets',
+}
+
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+class RollupWindow:
+    """
+    Fixed-size ring of time buckets for every protocol/metric pair.
+
+    All storage is allocated up front, so memory use depends only on the
+    number of slots and never on uptime. Within a bucket 'new' and 'closed'
+    are summed, 'remotes' estimates distinct remote IPs with a HyperLogLog
+    sketch and 'live' keeps the peak number of live sockets.
+    """
+    def __init__(self, name, resolution, slots, precision=12):
+        self.name = name
+        self.resolution = resolution  # seconds per bucket
+        self.slots = slots
+        self.bucket_ids = array('q', [-1] * slots)
+        self.values = {
+            (protocol, metric): array('q', [0] * slots)
+            for protocol in PROTOCOLS for metric in METRICS
+        }
+        self.current_bucket = -1
+        # Distinct remote IPs of the current bucket. A bucket that only saw one
+        # remotes set is counted exactly from it; the sketch is filled once a
+        # different set arrives, and its estimate is written to the bucket's
+        # slot when the slot is read or the bucket closes
+        self.remote_sketches = {protocol: HyperLogLog(precision) for protocol in PROTOCOLS}
+        self.sketched = set()
+        self.stale_remotes = set()
+        # The first remotes set (and its hashes) of the bucket per protocol.
+        # Until the sketch is filled every later set is a subset of it
+        self.first_remotes = dict.fromkeys(PROTOCOLS)
+        self.first_hashes = dict.fromkeys(PROTOCOLS)
+        # The last remotes set per protocol; repeated snapshots pass the same set
+        self.merged_remotes = dict.fromkeys(PROTOCOLS)
+
+    def advance(self, bucket):
+        """Start a new bucket, recycling the slot it maps to"""
+        self.store_remotes()
+        slot = bucket % self.slots
+        self.bucket_ids[slot] = bucket
+        for series in self.values.values():
+            series[slot] = 0
+        for protocol in self.sketched:
+            self.remote_sketches[protocol].clear()
+        self.sketched.clear()
+        self.first_remotes = dict.fromkeys(PROTOCOLS)
+        self.first_hashes = dict.fromkeys(PROTOCOLS)
+        self.merged_remotes = dict.fromkeys(PROTOCOLS)
+        self.current_bucket = bucket
+
+    def store_remotes(self):
+        """Write the distinct remote estimates of the current bucket to its slot"""
+        slot = self.current_bucket % self.slots
+        for protocol in self.stale_remotes:
+            self.values[(protocol, 'remotes')][slot] = self.remote_sketches[protocol].estimate()
+        self.stale_remotes.clear()
+
+    def record(self, timestamp, protocol, new, closed, remotes, remote_hashes, live):
+        bucket = int(timestamp // self.resolution)
+        # A clock that steps backwards keeps writing into the current bucket
+        if bucket > self.current_bucket:
+            self.advance(bucket)
+        slot = self.current_bucket % self.slots
+
+        self.values[(protocol, 'new')][slot] += new
+        self.values[(protocol, 'closed')][slot] += closed
+
+        last_remotes = self.merged_remotes[protocol]
+        if remotes is not last_remotes:
+            if last_remotes is None:
+                self.values[(protocol, 'remotes')][slot] = len(remotes)
+                self.first_remotes[protocol] = remotes
+                self.first_hashes[protocol] = remote_hashes
+            else:
+                # Remotes present in the previous sample are already counted
+                fresh = remotes - last_remotes
+                if fresh:
+                    sketch = self.remote_sketches[protocol]
+                    if protocol not in self.sketched:
+                        first_hashes = self.first_hashes[protocol]
+                        for remote in self.first_remotes[protocol]:
+                            sketch.add_hash(first_hashes[remote])
+                        self.sketched.add(protocol)
+                        self.first_remotes[protocol] = self.first_hashes[protocol] = None
+                    for remote in fresh:
+                        sketch.add_hash(remote_hashes[remote])
+                    self.stale_remotes.add(protocol)
+            self.merged_remotes[protocol] = remotes
+
+        live_series = self.values[(protocol, 'live')]
+        if live > live_series[slot]:
+            live_series[slot] = live
+
+    def series(self, protocol, metric, now=None):
+        """
+        Return the values of the last `slots` buckets, oldest first.
+        Buckets with no samples are reported as 0.
+        """
+        if metric == 'remotes':
+            self.store_remotes()
+        end = self.current_bucket
+        if now is not None:
+            end = max(end, int(now // self.resolution))
+        values = self.values[(protocol, metric)]
+        result = []
+        for bucket in range(end - self.slots + 1, end + 1):
+            slot = bucket % self.slots
+            result.append(values[slot] if self.bucket_ids[slot] == bucket else 0)
+        return result
+
+class ConnectionRollups:
+    """Per-second, per-minute and per-hour rollups of connection activity"""
+    def __init__(self):
+        self.windows = {
+            'second': RollupWindow('Per second (last minute)', 1, 60),
+            'minute': RollupWindow('Per minute (last hour)', 60, 60),
+            'hour': RollupWindow('Per hour (last day)', 3600, 24),
+        }
+        # Hashes of the last remotes set per protocol, so each remote IP is
+        # hashed once while it stays live rather than once per window and bucket
+        self.last_remotes = dict.fromkeys(PROTOCOLS)
+        self.remote_hashes = {protocol: {} for protocol in PROTOCOLS}
+
+    def record(self, timestamp, protocol, new, closed, remotes, live):
+        """
+        Record one sample for a protocol.
+
+        Args:
+            timestamp: Sample time in seconds since the epoch
+            protocol: 'TCP' or 'UDP'
+            new: Number of newly discovered connections
+            closed: Number of connections that disappeared since the last sample
+            remotes: Set of remote IPs present in the sample
+            live: Number of live sockets in the sample
+        """
+        if remotes is not self.last_remotes[protocol]:
+            known = self.remote_hashes[protocol]
+            self.remote_hashes[protocol] = {
+                remote: known[remote] if remote in known else hash64(remote) for remote in remotes
+            }
+            self.last_remotes[protocol] = remotes
+        remote_hashes = self.remote_hashes[protocol]
+        for window in self.windows.values():
+            window.record(timestamp, protocol, new, closed, remotes, remote_hashes, live)
+
+    def series(self, resolution, protocol, metric, now=None):
+        return self.windows[resolution].series(protocol, metric, now)
+
+def sparkline(values):
+    """Render a sequence of numbers as a unicode sparkline string"""
+    if not values:
+        return ''
+    peak = max(values)
+    if peak <= 0:
+        return SPARK_CHARS[0] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / peak
+    return ''.join(SPARK_CHARS[int(value * scale)] for value in values)
+
+def write_rollup_summary(rollups, txtfile):
+    """Append a rollup summary section to an open text file"""
+    now = datetime.now().timestamp()
+    txtfile.write("\nConnection Rollups:\n")
+    txtfile.write("=" * 40 + "\n")
+    for window in rollups.windows.values():
+        txtfile.write(f"{window.name}:\n")
+        for protocol in PROTOCOLS:
+            txtfile.write(f"  {protocol}:\n")
+            for metric in METRICS:
+                values = window.series(protocol, metric, now)
+                if metric in ('new', 'closed'):
+                    detail = f"total {sum(values)}, peak {max(values)}/bucket"
+                else:
+                    detail = f"peak {max(values)}"
+                txtfile.write(f"    {METRIC_NAMES[metric]}: {detail}  {sparkline(values)}\n")
+        txtfile.write("-" * 40 + "\n")
@@ -0,0 +1,479 @@
+import heapq
+import multiprocessing
+import os
+import signal
+import threading
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from datetime import datetime
+from itertools import chain
+from multiprocessing import shared_memory
+from operator import itemgetter, xor
+
+from networkmonitor import ConnectionTracker
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Sockets are grouped by shard with a Python sort instead
+
+MIN_BUFFER_SIZE = 1 << 16
+
+def shard_table(shards):
+    """
+    Map every value of local_port ^ remote_port to a shard. The XOR does not
+    depend on the direction of the connection, so both ends of a connection,
+    which share one canonical key, always land on the same shard.
+    """
+    return array('H', ((((value * 0x9E3779B1) & 0xffffffff) >> 16) % shards for value in range(65536)))
+
+class SnapshotBuffer:
+    """
+    Shared memory holding the current snapshot grouped by shard, so that each
+    shard reads only its own sockets. One block holds the snapshot positions
+    as uint32 followed by the local and remote ports as uint16, in shard
+    order. Every shard has a block of its own with its local IPs, remote
+    IPs, statuses and protocols as one NUL-separated UTF-8 string. Building
+    it needs no per-tuple pickling, and a shard decodes its part with a
+    handful of C-level calls.
+
+    This runs in the parent for every update, so it bounds the speedup of
+    the shards. With NumPy the shard of every socket is computed and sorted
+    on the packed port columns, and the strings are written one shard at a
+    time, so each shard starts as soon as its own part is ready.
+    """
+    def __init__(self, table, shards):
+        self.table = table
+        self.shards = shards
+        self.table_array = np.frombuffer(table, dtype=np.uint16) if np is not None else None
+        self.ports = None
+        self.strings = [None] * shards
+
+    def partition(self, local_ports, remote_ports):
+        """
+        Group the sockets of a snapshot by shard, keeping snapshot order within a shard.
+        Returns:
+            tuple: (snapshot positions in grouped order as uint32, grouped local
+                ports, grouped remote ports, socket count per shard)
+        """
+        if self.table_array is not None:
+            local_ports = np.frombuffer(local_ports, dtype=np.uint16)
+            remote_ports = np.frombuffer(remote_ports, dtype=np.uint16)
+            shard_ids = self.table_array[local_ports ^ remote_ports]
+            order = np.argsort(shard_ids, kind='stable')
+            counts = np.bincount(shard_ids, minlength=self.shards).tolist()
+            return order.astype(np.uint32), local_ports[order], remote_ports[order], counts
+
+        shard_ids = list(map(self.table.__getitem__, map(xor, local_ports, remote_ports)))
+        order = sorted(range(len(shard_ids)), key=shard_ids.__getitem__)
+        counts = Counter(shard_ids)
+        return (array('I', order), array('H', map(local_ports.__getitem__, order)),
+                array('H', map(remote_ports.__getitem__, order)), [counts[shard] for shard in range(self.shards)])
+
+    @staticmethod
+    def reserve(shm, needed):
+        """Return `shm` if it holds `needed` bytes, otherwise a larger block replacing it"""
+        if shm is not None and shm.size >= needed:
+            return shm
+        size = max(needed, MIN_BUFFER_SIZE, 2 * shm.size if shm else 0)
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        return shared_memory.SharedMemory(create=True, size=size)
+
+    def write(self, connections):
+        """
+        Store a snapshot, one shard's strings at a time.
+        Yields:
+            tuple: (shard, layout) as soon as the shard's part is stored; the
+                layout is (ports block name, socket count, first row, row count,
+                strings block name, string bytes)
+        """
+        n = len(connections)
+        order, local_ports, remote_ports, counts = self.partition(
+            array('H', map(itemgetter(1), connections)), array('H', map(itemgetter(3), connections))
+        )
+        self.ports = self.reserve(self.ports, 8 * n)
+        buffer = self.ports.buf
+        buffer[:4 * n] = memoryview(order).cast('B')
+        buffer[4 * n:6 * n] = memoryview(local_ports).cast('B')
+        buffer[6 * n:8 * n] = memoryview(remote_ports).cast('B')
+        grouped = list(map(connections.__getitem__, order.tolist()))
+
+        row = 0
+        for shard, count in enumerate(counts):
+            part = grouped[row:row + count]
+            blob = '\0'.join(chain(map(itemgetter(0), part), map(itemgetter(2), part),
+                                   map(itemgetter(4), part), map(itemgetter(5), part))).encode('utf-8')
+            strings = self.strings[shard] = self.reserve(self.strings[shard], len(blob))
+            strings.buf[:len(blob)] = blob
+            yield shard, (self.ports.name, n, row, count, strings.name, len(blob))
+            row += count
+
+    def close(self):
+        for shm in [self.ports] + self.strings:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self.ports = None
+        self.strings = [None] * self.shards
+
+def read_partition(ports, strings, layout):
+    """
+    Decode one shard's part of a snapshot written by SnapshotBuffer.
+
+    Args:
+        ports: The snapshot's ports block
+        strings: The shard's strings block
+        layout: The layout SnapshotBuffer.write yielded for the shard
+    Returns:
+        tuple: (snapshot positions, connection tuples)
+    """
+    _, n, row, count, _, string_bytes = layout
+    if not count:
+        return array('I'), []
+    buffer = ports.buf
+    positions = array('I')
+    positions.frombytes(buffer[4 * row:4 * (row + count)])
+    local_ports = array('H')
+    local_ports.frombytes(buffer[4 * n + 2 * row:4 * n + 2 * (row + count)])
+    remote_ports = array('H')
+    remote_ports.frombytes(buffer[6 * n + 2 * row:6 * n + 2 * (row + count)])
+    strings = bytes(strings.buf[:string_bytes]).decode('utf-8').split('\0')
+    connections = list(zip(strings[:count], local_ports, strings[count:2 * count], remote_ports,
+                           strings[2 * count:3 * count], strings[3 * count:]))
+    return positions, connections
+
+class ShardTracker(ConnectionTracker):
+    """
+    The part of a ShardedConnectionTracker that runs in a worker process.
+    It keeps the connection records of its shard; rollups and analytics are
+    kept by the parent.
+    """
+    def __init__(self):
+        super().__init__()
+        # Global discovery order of each record, in dict insertion order
+        self.discovery = {'TCP': array('Q'), 'UDP': array('Q')}
+
+    def update_partition(self, positions, connections, tick, current_time):
+        """
+        Merge this shard's sockets of one snapshot.
+
+        Args:
+            positions: Snapshot positions of the sockets, ascending
+            connections: The connection tuples at those positions
+            tick: Number of the update, used to order records across shards
+            current_time: Sample time shared by all shards
+        Returns:
+            tuple: (positions of new connections, positions of status changes,
+                new/closed/live counts and remote IP sets per protocol)
+        """
+        self.sync()
+        new_positions = []
+        changed_positions = []
+        live_keys = {'TCP': set(), 'UDP': set()}
+        live_repeats = {'TCP': {}, 'UDP': {}}
+        remotes = {'TCP': set(), 'UDP': set()}
+        new_counts = {'TCP': 0, 'UDP': 0}
+
+        for position, conn_info in zip(positions, connections):
+            protocol = conn_info[5]
+            connections_dict = self.tcp_connections if protocol == 'TCP' else self.udp_connections
+
+            key = self.get_connection_key(conn_info)
+            conn_data = connections_dict[key]
+            repeated = key in live_keys[protocol]
+            if repeated:
+                repeats = live_repeats[protocol]
+                repeats[key] = repeats.get(key, 0) + 1
+            else:
+                live_keys[protocol].add(key)
+            if conn_info[2]:
+                remotes[protocol].add(conn_info[2])
+            if conn_data['first_seen'] is None:
+                conn_data.update({
+                    'first_seen': current_time,
+                    'info': conn_info,
+                    'status': conn_info[4],
+                    'count': 1
+                })
+                new_positions.append(position)
+                new_counts[protocol] += 1
+                self.discovery[protocol].append(tick << 32 | position)
+            else:
+                conn_data['count'] += 1
+                # Only the recorded side of a local connection changes its status
+                if conn_info[4] != conn_data['status'] and not repeated \
+                        and conn_info[:2] == conn_data['info'][:2]:
+                    self.record_transition(conn_data, conn_info[4], current_time)
+                    changed_positions.append(position)
+            conn_data['last_seen'] = current_time
+
+        closed = {protocol: len(self.live_keys[protocol] - keys) for protocol, keys in live_keys.items()}
+        live = {protocol: len(keys) for protocol, keys in live_keys.items()}
+        self.live_keys = live_keys
+        self.live_repeats = live_repeats
+        return new_positions, changed_positions, new_counts, closed, live, remotes
+
+    def records(self, protocol):
+        """Return (discovery order, key, record) for every record of a protocol, in order"""
+        self.sync()
+        connections = self.tcp_connections if protocol == 'TCP' else self.udp_connections
+        return list(zip(self.discovery[protocol], connections.keys(), connections.values()))
+
+def run_shard(connection):
+    """Worker process main loop: apply commands from the parent until told to stop"""
+    # Ctrl+C reaches the whole process group; the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    tracker = ShardTracker()
+    # Open shared memory blocks by name; the parent replaces a block when it outgrows it
+    blocks = {}
+    try:
+        while True:
+            command, *args = connection.recv()
+            if command == 'update':
+                layout, tick, current_time = args
+                names = (layout[0], layout[4])
+                for name in list(blocks):
+                    if name not in names:
+                        blocks.pop(name).close()
+                for name in names:
+                    if name not in blocks:
+                        blocks[name] = shared_memory.SharedMemory(name=name)
+                positions, connections = read_partition(blocks[layout[0]], blocks[layout[4]], layout)
+                connection.send(tracker.update_partition(positions, connections, tick, current_time))
+            elif command == 'sync':
+                tracker.pending_repeats, tracker.pending_time = args
+                tracker.sync()
+            elif command == 'metrics':
+                tracker.record_tcp_metrics(args[0])
+            elif command == 'records':
+                connection.send(tracker.records(args[0]))
+            elif command == 'stop':
+                break
+    except EOFError:
+        pass
+    finally:
+        for shm in blocks.values():
+            shm.close()
+
+class ShardedConnections(Mapping):
+    """
+    Read-only view of one protocol's records across all shards, shaped like
+    ConnectionTracker's tcp_connections/udp_connections and ordered the same
+    way. Every access fetches the records from the shards, so it is meant for
+    exports rather than per-tick lookups.
+    """
+    def __init__(self, tracker, protocol):
+        self.tracker = tracker
+        self.protocol = protocol
+
+    def fetch(self):
+        return self.tracker.fetch_records(self.protocol)
+
+    def __getitem__(self, key):
+        return self.fetch()[key]
+
+    def __iter__(self):
+        return iter(self.fetch())
+
+    def __len__(self):
+        return self.tracker.total_tcp_tracked if self.protocol == 'TCP' else self.tracker.total_udp_tracked
+
+    def values(self):
+        return self.fetch().values()
+
+    def items(self):
+        return self.fetch().items()
+
+class ShardedConnectionTracker(ConnectionTracker):
+    """
+    ConnectionTracker that spreads the connection records over `shards`
+    worker processes, so updates of very large snapshots use several cores.
+
+    Each snapshot is written once to shared memory, grouped by shard (see
+    SnapshotBuffer); every shard decodes only its own sockets and merges
+    them into its own records. Rollups, analytics, totals and
+    unchanged-snapshot skipping stay in this process. Newly discovered
+    connections, exports and status counts are identical to the
+    single-process tracker. tcp_connections and udp_connections are
+    read-only views that fetch the records from the shards on access.
+
+    Call close() to stop the worker processes; the tracker cannot be used
+    after that.
+    """
+    def __init__(self, shards=None):
+        self.shards = shards or multiprocessing.cpu_count()
+        if not 1 <= self.shards <= 65536:
+            raise ValueError(f"Invalid shard count: {self.shards}")
+        super().__init__()
+        self.table = shard_table(self.shards)
+        self.buffer = SnapshotBuffer(self.table, self.shards)
+        self.live_counts = {'TCP': 0, 'UDP': 0}
+        self.tcp_connections = ShardedConnections(self, 'TCP')
+        self.udp_connections = ShardedConnections(self, 'UDP')
+        if os.name == 'posix':
+            # Start the resource tracker first so the shards share it; one of
+            # their own would unlink the snapshot buffer when the shard exits
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        self.connections = []
+        self.processes = []
+        self.closed = False
+        # One conversation with the shards at a time (the GUI exports from another thread)
+        self.lock = threading.RLock()
+        # Shards whose update reply has not been read, e.g. after Ctrl+C
+        self.unanswered = set()
+        for index in range(self.shards):
+            parent_end, child_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_shard, args=(child_end,),
+                                              name=f"netconmon-shard-{index}", daemon=True)
+            process.start()
+            child_end.close()
+            self.connections.append(parent_end)
+            self.processes.append(process)
+
+    def shard_of(self, conn_info):
+        return self.table[conn_info[1] ^ conn_info[3]]
+
+    def check_open(self):
+        if self.closed:
+            raise RuntimeError("The sharded tracker has been closed; its records are gone")
+
+    def receive(self, index):
+        try:
+            reply = self.connections[index].recv()
+        except EOFError:
+            raise RuntimeError(f"Tracker shard {index} stopped unexpectedly") from None
+        self.unanswered.discard(index)
+        return reply
+
+    def discard_unanswered(self):
+        """Drop replies to an update that was interrupted, so they are not read as other answers"""
+        for index in sorted(self.unanswered):
+            self.receive(index)
+
+    def update(self, new_connections, fingerprint=None):
+        """
+        Update the connection history with new connections.
+        Returns newly discovered connections for both TCP and UDP.
+        """
+        with self.lock:
+            self.check_open()
+            current_time = datetime.now()
+            if fingerprint is not None and fingerprint == self.last_fingerprint:
+                self.repeat_last_snapshot(current_time)
+                return []
+
+            self.sync()
+            self.ticks_processed += 1
+            if not isinstance(new_connections, list):
+                new_connections = list(new_connections)
+            # A shard may still be reading the buffer for an interrupted update
+            self.discard_unanswered()
+            for index, layout in self.buffer.write(new_connections):
+                self.connections[index].send(('update', layout, self.ticks_processed, current_time))
+                self.unanswered.add(index)
+
+            new_positions = []
+            changed_positions = []
+            new_counts = {'TCP': 0, 'UDP': 0}
+            closed = {'TCP': 0, 'UDP': 0}
+            live = {'TCP': 0, 'UDP': 0}
+            remotes = {'TCP': set(), 'UDP': set()}
+            for index in range(self.shards):
+                shard_new, shard_changed, shard_new_counts, shard_closed, shard_live, \
+                    shard_remotes = self.receive(index)
+                new_positions.extend(shard_new)
+                changed_positions.extend(shard_changed)
+                for protocol in ('TCP', 'UDP'):
+                    new_counts[protocol] += shard_new_counts[protocol]
+                    closed[protocol] += shard_closed[protocol]
+                    live[protocol] += shard_live[protocol]
+                    remotes[protocol] |= shard_remotes[protocol]
+
+            newly_discovered = [new_connections[position] for position in sorted(new_positions)]
+            self.status_changes = [new_connections[position] for position in sorted(changed_positions)]
+            self.total_tcp_tracked += new_counts['TCP']
+            self.total_udp_tracked += new_counts['UDP']
+
+            timestamp = current_time.timestamp()
+            for protocol in ('TCP', 'UDP'):
+                self.rollups.record(timestamp, protocol, new_counts[protocol], closed[protocol],
+                                    remotes[protocol], live[protocol])
+            self.live_counts = live
+            self.live_remotes = remotes
+            self.all_live_remotes = remotes['TCP'] | remotes['UDP']
+            self.analytics.update(timestamp, newly_discovered, self.all_live_remotes)
+            self.last_fingerprint = fingerprint
+            return newly_discovered
+
+    def repeat_last_snapshot(self, current_time):
+        """Account for a snapshot identical to the last processed one"""
+        self.ticks_skipped += 1
+        self.pending_repeats += 1
+        self.status_changes = []
+        self.pending_time = current_time
+
+        timestamp = current_time.timestamp()
+        for protocol, count in self.live_counts.items():
+            self.rollups.record(timestamp, protocol, 0, 0, self.live_remotes[protocol], count)
+        self.analytics.update(timestamp, (), self.all_live_remotes)
+
+    def sync(self):
+        """Hand skipped repeats to the shards; they apply them before their next command"""
+        with self.lock:
+            if not self.pending_repeats:
+                return
+            self.check_open()
+            for connection in self.connections:
+                connection.send(('sync', self.pending_repeats, self.pending_time))
+            self.pending_repeats = 0
+
+    def record_tcp_metrics(self, samples):
+        """Route tcp_info samples to the shards holding their connections"""
+        with self.lock:
+            self.check_open()
+            routed = [[] for _ in range(self.shards)]
+            for sample in samples:
+                routed[self.shard_of(sample[0])].append(sample)
+            for connection, shard_samples in zip(self.connections, routed):
+                if shard_samples:
+                    connection.send(('metrics', shard_samples))
+
+    def fetch_records(self, protocol):
+        """
+        Collect one protocol's records from all shards.
+        Returns:
+            dict: key -> record, in discovery order as in ConnectionTracker
+        """
+        with self.lock:
+            self.check_open()
+            self.sync()
+            self.discard_unanswered()
+            for connection in self.connections:
+                connection.send(('records', protocol))
+            parts = [self.receive(index) for index in range(self.shards)]
+            return {key: record for _, key, record in heapq.merge(*parts, key=itemgetter(0))}
+
+    def close(self):
+        """Stop the worker processes and release the shared snapshot buffer"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for connection in self.connections:
+                try:
+                    connection.send(('stop',))
+                except OSError:
+                    pass
+            for process in self.processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+            self.processes = []
+            self.buffer.close()
@@ -0,0 +1,198 @@
+import heapq
+import math
+from array import array
+from hashlib import blake2b
+from itertools import count as counter
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitter sketch.
+
+    Keeps at most `capacity` counters. Every reported count overestimates the
+    true count by at most its error value, which is bounded by
+    total / capacity, so any item that occurs more than total / capacity
+    times is guaranteed to be tracked.
+
+    The smallest counter is found with a min-heap holding one entry per
+    item. Increments leave the heap alone, so entries may be stale (too
+    low); a stale entry is refreshed when it reaches the top.
+    """
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        self.heap = []  # (count when pushed, sequence, item)
+        self.sequence = counter()
+
+    def add(self, item, count=1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        if len(self.counts) < self.capacity:
+            floor = 0
+        else:
+            # Replace the smallest counter; the new item inherits its count as error
+            heap = self.heap
+            while True:
+                floor, _, victim = heap[0]
+                current = self.counts[victim]
+                if current == floor:
+                    break
+                heapq.heapreplace(heap, (current, next(self.sequence), victim))
+            heapq.heappop(heap)
+            del self.counts[victim]
+            del self.errors[victim]
+        self.counts[item] = floor + count
+        self.errors[item] = floor
+        heapq.heappush(self.heap, (floor + count, next(self.sequence), item))
+
+    @property
+    def error_bound(self):
+        """Maximum overestimate of any reported count"""
+        return self.total // self.capacity
+
+    def top(self, k):
+        """
+        Return the k heaviest items.
+        Returns:
+            list: (item, estimated count, maximum overestimate) tuples
+        """
+        ranked = sorted(self.counts.items(), key=lambda entry: entry[1], reverse=True)[:k]
+        return [(item, count, self.errors[item]) for item, count in ranked]
+
+def hash64(value):
+    """Stable 64-bit hash of a value's string form"""
+    return int.from_bytes(blake2b(str(value).encode(), digest_size=8).digest(), 'little')
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct-count sketch with 2**precision one-byte registers.
+    The relative standard error is about 1.04 / sqrt(2**precision).
+    """
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value):
+        self.add_hash(hash64(value))
+
+    def add_hash(self, hashed):
+        """Add a value by its hash64"""
+        index = hashed & (self.size - 1)
+        remaining = hashed >> self.precision
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def clear(self):
+        self.registers[:] = bytes(self.size)
+
+    def merge(self, other):
+        """Fold another sketch with the same precision into this one"""
+        self.registers[:] = bytes(map(max, self.registers, other.registers))
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.size)
+
+    def estimate(self):
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+class SlidingHyperLogLog:
+    """
+    Distinct counts over a sliding window, built from a fixed ring of
+    per-bucket HyperLogLog sketches merged at query time.
+    """
+    def __init__(self, bucket_seconds=60, buckets=60, precision=12):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.precision = precision
+        self.sketches = [HyperLogLog(precision) for _ in range(buckets)]
+        self.bucket_ids = array('q', [-1] * buckets)
+        self.current_bucket = -1
+        # The previous sample; only values not in it need hashing, and an
+        # identical sample (the same set object) costs nothing
+        self.last_values = None
+
+    def add_many(self, timestamp, values):
+        bucket = int(timestamp // self.bucket_seconds)
+        if bucket > self.current_bucket:
+            slot = bucket % self.buckets
+            self.sketches[slot].clear()
+            self.bucket_ids[slot] = bucket
+            self.current_bucket = bucket
+            self.last_values = None
+
+        if values is self.last_values:
+            return
+        fresh = values if self.last_values is None else values - self.last_values
+        self.last_values = values
+        sketch = self.sketches[self.current_bucket % self.buckets]
+        for value in fresh:
+            sketch.add(value)
+
+    @property
+    def max_window(self):
+        return self.bucket_seconds * self.buckets
+
+    def distinct(self, window_seconds, now):
+        """Estimate distinct values seen in the last `window_seconds` (rounded up to whole buckets)"""
+        end = int(now // self.bucket_seconds)
+        span = min(self.buckets, max(1, math.ceil(window_seconds / self.bucket_seconds)))
+        merged = HyperLogLog(self.precision)
+        for bucket in range(end - span + 1, end + 1):
+            slot = bucket % self.buckets
+            if self.bucket_ids[slot] == bucket:
+                merged.merge(self.sketches[slot])
+        return merged.estimate()
+
+class RemoteEndpointAnalytics:
+    """
+    Bounded-memory analytics over remote endpoints: heavy hitters by new
+    connection count and sliding-window distinct remote IPs.
+    """
+    def __init__(self, capacity=256, precision=12):
+        self.top_ips = SpaceSaving(capacity)
+        self.top_ports = SpaceSaving(capacity)
+        self.distinct_remotes = SlidingHyperLogLog(bucket_seconds=60, buckets=60, precision=precision)
+
+    def update(self, timestamp, new_connections, remotes):
+        """
+        Feed one tracker update.
+
+        Args:
+            timestamp: Sample time in seconds since the epoch
+            new_connections: Connection tuples discovered in this sample
+            remotes: Set of remote IPs present in this sample
+        """
+        for conn in new_connections:
+            if conn[2]:
+                self.top_ips.add(conn[2])
+                self.top_ports.add(f"{conn[5]}/{conn[3]}")
+        self.distinct_remotes.add_many(timestamp, remotes)
+
+    def report(self, now, top=20):
+        """Return the analytics as a list of text lines"""
+        hll = self.distinct_remotes
+        error = HyperLogLog(hll.precision).relative_error * 100
+        lines = [
+            f"Distinct remote IPs (±{error:.1f}%): "
+            f"last 5 min {hll.distinct(300, now)}, last hour {hll.distinct(3600, now)}",
+            f"Top {top} remote IPs by connection count (counts may be high by at most {self.top_ips.error_bound}):",
+        ]
+        for ip, count, _ in self.top_ips.top(top):
+            lines.append(f"  {ip:<40} {count}")
+        lines.append(f"Top {top} remote ports by connection count (counts may be high by at most {self.top_ports.error_bound}):")
+        for port, count, _ in self.top_ports.top(top):
+            lines.append(f"  {port:<40} {count}")
+        return lines
@@ -0,0 +1,115 @@
+from array import array
+from collections import defaultdict
+
+# Connection statuses are stored as one-byte codes. psutil's status names are
+# registered up front; anything else (platform specific) is added on demand.
+STATUSES = [
+    'NONE', 'ESTABLISHED', 'SYN_SENT', 'SYN_RECV', 'FIN_WAIT1', 'FIN_WAIT2',
+    'TIME_WAIT', 'CLOSE', 'CLOSE_WAIT', 'LAST_ACK', 'LISTEN', 'CLOSING',
+    'DELETE_TCB', 'IDLE', 'BOUND',
+]
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# Largest millisecond delta a history stores (about 49.7 days); longer gaps are clamped
+MAX_DELTA = 0xFFFFFFFF
+
+def status_code(status):
+    """Return the one-byte code for a status name, registering it if new"""
+    code = STATUS_CODES.get(status)
+    if code is None:
+        if len(STATUSES) > 255:
+            return STATUS_CODES['NONE']
+        code = len(STATUSES)
+        STATUSES.append(status)
+        STATUS_CODES[status] = code
+    return code
+
+class StateHistory:
+    """
+    Compact status history of one connection.
+
+    `states` holds one status code per entry and `deltas` the milliseconds
+    elapsed since the previous entry as unsigned 32-bit integers (the first
+    entry is relative to `start`), so a transition costs five bytes. A gap
+    longer than MAX_DELTA is stored as MAX_DELTA.
+    """
+    __slots__ = ('start', 'states', 'deltas', 'last_change')
+
+    def __init__(self, status, timestamp):
+        self.start = timestamp
+        self.states = bytearray((status_code(status),))
+        self.deltas = array('I', (0,))
+        self.last_change = timestamp
+
+    def record(self, status, timestamp):
+        """Append a status change observed at `timestamp` (seconds since the epoch)"""
+        elapsed = min(MAX_DELTA, max(0, int(round((timestamp - self.last_change) * 1000))))
+        self.states.append(status_code(status))
+        self.deltas.append(elapsed)
+        self.last_change = timestamp
+
+    def __len__(self):
+        return len(self.states)
+
+    def intervals(self, end):
+        """
+        Yield (status, start, duration) for every state, in seconds.
+        The last state is considered to last until `end`.
+        """
+        time = self.start
+        for index, code in enumerate(self.states):
+            time += self.deltas[index] / 1000
+            if index + 1 < len(self.states):
+                duration = self.deltas[index + 1] / 1000
+            else:
+                duration = max(0.0, end - time)
+            yield STATUSES[code], time, duration
+
+    def transitions(self):
+        """Yield (from status, to status) pairs in order"""
+        for index in range(1, len(self.states)):
+            yield STATUSES[self.states[index - 1]], STATUSES[self.states[index]]
+
+def time_in_state(connections):
+    """
+    Aggregate time-in-state metrics over a protocol's connection table.
+    Returns:
+        tuple: ({status: [total seconds, connections]}, {(from, to): count})
+    """
+    durations = defaultdict(lambda: [0.0, 0])
+    transitions = defaultdict(int)
+    for conn_data in connections.values():
+        if not conn_data['first_seen']:
+            continue
+        end = conn_data['last_seen'].timestamp()
+        history = conn_data['history']
+        if history is None:
+            totals = durations[conn_data['info'][4]]
+            totals[0] += end - conn_data['first_seen'].timestamp()
+            totals[1] += 1
+            continue
+        visited = set()
+        for status, _, duration in history.intervals(end):
+            durations[status][0] += duration
+            visited.add(status)
+        for status in visited:
+            durations[status][1] += 1
+        for transition in history.transitions():
+            transitions[transition] += 1
+    return durations, transitions
+
+def write_state_metrics(tracker, txtfile):
+    """Append aggregate time-in-state metrics to an open text file"""
+    txtfile.write("\nTime in State:\n")
+    txtfile.write("=" * 40 + "\n")
+    for protocol, connections in (('TCP', tracker.tcp_connections), ('UDP', tracker.udp_connections)):
+        durations, transitions = time_in_state(connections)
+        txtfile.write(f"{protocol}:\n")
+        for status, (total, count) in sorted(durations.items(), key=lambda entry: -entry[1][0]):
+            txtfile.write(f"  {status}: {total:.1f}s total across {count} connections "
+                          f"(avg {total / count:.1f}s)\n")
+        if transitions:
+            txtfile.write("  Transitions:\n")
+            for (before, after), count in sorted(transitions.items(), key=lambda entry: -entry[1]):
+                txtfile.write(f"    {before} → {after}: {count}\n")
+        txtfile.write("-" * 40 + "\n")
@@ -0,0 +1,279 @@
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+# Linux sock_diag interface (linux/sock_diag.h, linux/inet_diag.h)
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+INET_DIAG_INFO = 2
+INET_DIAG_NOCOOKIE = 0xffffffff
+
+NLMSG_HEADER = struct.Struct('=IHHII')
+DIAG_REQUEST = struct.Struct('=BBBxI')
+SOCKET_ID = struct.Struct('>HH16s16s')
+SOCKET_ID_TAIL = struct.Struct('=III')
+DIAG_MSG = struct.Struct('=BBBB')
+DIAG_MSG_SIZE = 72
+RTATTR = struct.Struct('=HH')
+
+# Kernel TCP state numbers, as used in inet_diag_msg.idiag_state
+TCP_STATES = {
+    1: 'ESTABLISHED', 2: 'SYN_SENT', 3: 'SYN_RECV', 4: 'FIN_WAIT1', 5: 'FIN_WAIT2',
+    6: 'TIME_WAIT', 7: 'CLOSE', 8: 'CLOSE_WAIT', 9: 'LAST_ACK', 10: 'LISTEN', 11: 'CLOSING',
+}
+TCP_LISTEN = 10
+# Every state except LISTEN; the tracker only follows sockets with a remote end
+CONNECTED_STATES = 0xfff & ~(1 << TCP_LISTEN)
+
+# Offsets of the fields we use in struct tcp_info (linux/tcp.h)
+TCPI_RTT = struct.Struct('=II')          # tcpi_rtt, tcpi_rttvar at 68
+TCPI_SND_CWND = struct.Struct('=I')      # at 80
+TCPI_TOTAL_RETRANS = struct.Struct('=I') # at 100
+TCPI_BYTES = struct.Struct('=QQ')        # tcpi_bytes_acked, tcpi_bytes_received at 120
+
+METRIC_COLUMNS = ['RTT (ms)', 'RTT Var (ms)', 'Cwnd', 'Retransmits',
+                  'Bytes Acked', 'Bytes Received', 'Send Rate (B/s)', 'Receive Rate (B/s)']
+
+MAX_LOOKUPS_PER_TICK = 256
+
+class TcpMetrics:
+    """One tcp_info sample of a connection, with rates relative to the previous sample"""
+    __slots__ = ('sampled_at', 'rtt_us', 'rttvar_us', 'cwnd', 'total_retrans',
+                 'bytes_acked', 'bytes_received', 'send_rate', 'receive_rate')
+
+    def __init__(self, sampled_at, rtt_us, rttvar_us, cwnd, total_retrans,
+                 bytes_acked=None, bytes_received=None):
+        self.sampled_at = sampled_at
+        self.rtt_us = rtt_us
+        self.rttvar_us = rttvar_us
+        self.cwnd = cwnd
+        self.total_retrans = total_retrans
+        self.bytes_acked = bytes_acked
+        self.bytes_received = bytes_received
+        self.send_rate = None
+        self.receive_rate = None
+
+    def add_deltas(self, previous):
+        """Derive throughput from the previous sample of the same connection"""
+        if previous is None or self.bytes_acked is None or previous.bytes_acked is None:
+            return
+        elapsed = self.sampled_at - previous.sampled_at
+        # Counters going backwards means the 4-tuple now belongs to a new socket
+        if elapsed <= 0 or self.bytes_acked < previous.bytes_acked or \
+                self.bytes_received < previous.bytes_received:
+            return
+        self.send_rate = (self.bytes_acked - previous.bytes_acked) / elapsed
+        self.receive_rate = (self.bytes_received - previous.bytes_received) / elapsed
+
+    def columns(self):
+        """Values for METRIC_COLUMNS"""
+        def optional(value, fmt='{}'):
+            return '' if value is None else fmt.format(value)
+        return [
+            f"{self.rtt_us / 1000:.3f}", f"{self.rttvar_us / 1000:.3f}", self.cwnd, self.total_retrans,
+            optional(self.bytes_acked), optional(self.bytes_received),
+            optional(self.send_rate, '{:.0f}'), optional(self.receive_rate, '{:.0f}'),
+        ]
+
+    def describe(self):
+        text = (f"RTT {self.rtt_us / 1000:.2f}ms (±{self.rttvar_us / 1000:.2f}), "
+                f"cwnd {self.cwnd}, retransmits {self.total_retrans}")
+        if self.bytes_acked is not None:
+            text += f", sent {self.bytes_acked} B, received {self.bytes_received} B"
+        if self.send_rate is not None:
+            text += f", {self.send_rate:.0f} B/s out, {self.receive_rate:.0f} B/s in"
+        return text
+
+def parse_tcp_info(payload, sampled_at):
+    """Build a TcpMetrics from a raw struct tcp_info, tolerating older, shorter layouts"""
+    if len(payload) < 104:
+        return None
+    rtt, rttvar = TCPI_RTT.unpack_from(payload, 68)
+    cwnd, = TCPI_SND_CWND.unpack_from(payload, 80)
+    total_retrans, = TCPI_TOTAL_RETRANS.unpack_from(payload, 100)
+    metrics = TcpMetrics(sampled_at, rtt, rttvar, cwnd, total_retrans)
+    if len(payload) >= 136:
+        metrics.bytes_acked, metrics.bytes_received = TCPI_BYTES.unpack_from(payload, 120)
+    return metrics
+
+def pack_address(ip):
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    return family, socket.inet_pton(family, ip).ljust(16, b'\0')
+
+def build_request(seq, family, flags, states, local=None, remote=None):
+    """Build one SOCK_DIAG_BY_FAMILY request, for a dump or a single socket"""
+    if local is None:
+        socket_id = SOCKET_ID.pack(0, 0, b'', b'') + SOCKET_ID_TAIL.pack(0, 0, 0)
+    else:
+        socket_id = (SOCKET_ID.pack(local[1], remote[1], local[0], remote[0]) +
+                     SOCKET_ID_TAIL.pack(0, INET_DIAG_NOCOOKIE, INET_DIAG_NOCOOKIE))
+    body = DIAG_REQUEST.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), states) + socket_id
+    return NLMSG_HEADER.pack(NLMSG_HEADER.size + len(body), SOCK_DIAG_BY_FAMILY, flags, seq, 0) + body
+
+def parse_diag_message(data, offset, length, sampled_at):
+    """
+    Parse an inet_diag_msg with its attributes.
+    Returns:
+        tuple: (connection info tuple, TcpMetrics or None)
+    """
+    family, state, _, _ = DIAG_MSG.unpack_from(data, offset)
+    local_port, remote_port, local_raw, remote_raw = SOCKET_ID.unpack_from(data, offset + 4)
+    size = 4 if family == socket.AF_INET else 16
+    local_ip = socket.inet_ntop(family, local_raw[:size])
+    remote_ip = socket.inet_ntop(family, remote_raw[:size])
+    conn_info = (local_ip, local_port, remote_ip, remote_port, TCP_STATES.get(state, 'NONE'), 'TCP')
+
+    metrics = None
+    position = offset + DIAG_MSG_SIZE
+    end = offset + length
+    while position + RTATTR.size <= end:
+        attr_length, attr_type = RTATTR.unpack_from(data, position)
+        if attr_length < RTATTR.size:
+            break
+        if attr_type == INET_DIAG_INFO:
+            payload = data[position + RTATTR.size:position + attr_length]
+            metrics = parse_tcp_info(payload, sampled_at)
+        position += (attr_length + 3) & ~3
+    return conn_info, metrics
+
+class SockDiag:
+    """Minimal NETLINK_SOCK_DIAG client for TCP sockets with tcp_info"""
+    def __init__(self, timeout=1.0):
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+        self.socket.settimeout(timeout)
+        self.seq = 0
+
+    def close(self):
+        self.socket.close()
+
+    def next_seq(self):
+        self.seq = (self.seq + 1) & 0xffffffff
+        return self.seq
+
+    def receive(self, expected, sampled_at):
+        """
+        Read replies until `expected` requests have completed.
+        Returns:
+            list: (connection info tuple, TcpMetrics) pairs
+        """
+        samples = []
+        while expected > 0:
+            data = self.socket.recv(1 << 16)
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, msg_type, flags, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+                if length < NLMSG_HEADER.size:
+                    return samples
+                if msg_type == SOCK_DIAG_BY_FAMILY:
+                    conn_info, metrics = parse_diag_message(
+                        data, offset + NLMSG_HEADER.size, length - NLMSG_HEADER.size, sampled_at
+                    )
+                    if metrics is not None:
+                        samples.append((conn_info, metrics))
+                    if not flags & 0x2:  # NLM_F_MULTI: single-socket replies complete here
+                        expected -= 1
+                elif msg_type in (NLMSG_DONE, NLMSG_ERROR):
+                    # ENOENT for a socket that closed before we asked is expected
+                    expected -= 1
+                offset += (length + 3) & ~3
+        return samples
+
+    def dump(self):
+        """Fetch tcp_info for every connected TCP socket"""
+        samples = []
+        for family in (socket.AF_INET, socket.AF_INET6):
+            self.socket.send(build_request(self.next_seq(), family, NLM_F_REQUEST | NLM_F_DUMP, CONNECTED_STATES))
+            samples.extend(self.receive(1, time.time()))
+        return samples
+
+    def lookup(self, connections):
+        """Fetch tcp_info for specific connections with one batched request"""
+        requests = []
+        for conn_info in connections:
+            try:
+                local_family, local_ip = pack_address(conn_info[0])
+                remote_family, remote_ip = pack_address(conn_info[2])
+            except (OSError, ValueError):
+                continue
+            if local_family != remote_family:
+                continue
+            requests.append(build_request(self.next_seq(), local_family, NLM_F_REQUEST, CONNECTED_STATES,
+                                          (local_ip, conn_info[1]), (remote_ip, conn_info[3])))
+        if not requests:
+            return []
+        self.socket.send(b''.join(requests))
+        return self.receive(len(requests), time.time())
+
+class TcpMetricsCollector:
+    """
+    Keeps tcp_info metrics of tracked TCP connections up to date without
+    slowing the sampling loop: new connections and connections whose status
+    changed are looked up right away (one batched netlink request per
+    tick), and a full dump runs in a background thread every `interval`
+    seconds.
+    """
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.diag = SockDiag()
+        self.results = queue.Queue()
+        self.last_dump = 0
+        self.dump_thread = None
+
+    @staticmethod
+    def available():
+        """Return True if sock_diag can be used on this system"""
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG).close()
+            return True
+        except (OSError, AttributeError):
+            return False
+
+    def refresh(self, tracker, new_connections):
+        """
+        Call after every tracker update with the connections it returned.
+        """
+        changed = [conn for conn in new_connections if conn[5] == 'TCP']
+        changed.extend(tracker.status_changes)
+        if changed:
+            try:
+                tracker.record_tcp_metrics(self.diag.lookup(changed[:MAX_LOOKUPS_PER_TICK]))
+            except OSError:
+                # Unread replies would be mistaken for the next request's; start afresh
+                # and leave these connections to the next full dump
+                self.diag.close()
+                self.diag = SockDiag()
+
+        while True:
+            try:
+                tracker.record_tcp_metrics(self.results.get_nowait())
+            except queue.Empty:
+                break
+
+        now = time.time()
+        if now - self.last_dump >= self.interval and \
+                (self.dump_thread is None or not self.dump_thread.is_alive()):
+            self.last_dump = now
+            self.dump_thread = threading.Thread(target=self.dump, daemon=True)
+            self.dump_thread.start()
+
+    def dump(self):
+        """Background full refresh; results are applied by the next refresh() call"""
+        diag = SockDiag(timeout=5.0)
+        try:
+            self.results.put(diag.dump())
+        except OSError as e:
+            print(f"\nTCP metrics dump failed: {e}")
+        finally:
+            diag.close()
+
+    def close(self):
+        self.diag.close()